@@ -0,0 +1,34 @@
+"""
+ASGI entry point
+
+Signing in and starting anonymous sessions, the routes that wait on Google,
+run on async handlers; every other route of main.py is served by the Flask app
+through a thread pool of ASGI_WSGI_THREADS threads.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8080
+
+To run against local stand-ins for Google, start `python stub_google.py` and
+set RECAPTCHA_VERIFY_URL=http://localhost:8090/recaptcha/api/siteverify and
+OAUTH_TOKEN_URI=http://localhost:8090/token.
+"""
+import os
+
+from starlette.applications import Starlette
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.routing import Route, Mount
+
+from main import app as flask_app
+from wordgameapi import async_handlers
+
+ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 30))
+
+app = Starlette(
+    routes=[
+        Route("/api/health-check", async_handlers.health_check, methods=['GET']),
+        Route("/api/auth", async_handlers.login, methods=['POST']),
+        Route("/api/session", async_handlers.create_game_session, methods=['POST']),
+        Mount("/", WSGIMiddleware(flask_app, workers=ASGI_WSGI_THREADS)),
+    ],
+    on_startup=[async_handlers.startup],
+    on_shutdown=[async_handlers.shutdown],
+)
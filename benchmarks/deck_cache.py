@@ -0,0 +1,92 @@
+"""
+Word selection from a category: ORDER BY ... LIMIT 1 OFFSET query vs. in-memory deck cache
+
+Usage (from the project root, against a populated database):
+
+    python -m benchmarks.deck_cache <category_id> [repeat]
+"""
+import sys
+from timeit import default_timer
+
+from sqlalchemy.sql import text
+
+from main import app
+from wordgameapi.models import db, Term
+from wordgameapi import decks
+from wordgameapi.shuffle import permute
+
+OFFSETS = (0, 500, 5000)
+SEED = 42
+
+
+def sql_term_from_category(category_id, seed, offset):
+    count_query = db.engine.execute(text(
+        """
+        SELECT COUNT(x.id) AS count_ FROM (
+            SELECT DISTINCT `term`.id, word, tags FROM `term`
+                  LEFT JOIN `nomen` ON word = form
+                WHERE SUBSTR(tags, 1, 11) = 'SUB:NOM:SIN'
+                  AND synset_id in
+                    (SELECT `synset_id` FROM `synset` AS S JOIN `category_link` AS CL ON S.id = CL.synset_id
+                        JOIN `category` AS C ON C.id = CL.category_id
+                        WHERE C.id = :category_id)
+        ) AS x
+        """
+        ),
+        category_id=category_id)
+    count = list(count_query)[0]['count_']
+
+    return db.session.query(Term)\
+        .from_statement(text(
+            """
+            SELECT DISTINCT `term`.id, word, tags, MOD(`term`.id, SIN(:seed) * :count -  FLOOR(SIN(:seed) * :count)) AS r
+            FROM `term` LEFT JOIN `nomen` ON word = form
+            WHERE SUBSTR(tags, 1, 11) = 'SUB:NOM:SIN'
+              AND synset_id in
+                (SELECT `synset_id` FROM `synset` AS S JOIN `category_link` AS CL ON S.id = CL.synset_id
+                    JOIN `category` AS C ON C.id = CL.category_id
+                    WHERE C.id = :category_id)
+            ORDER BY r
+            LIMIT 1 OFFSET :offset
+            """
+        ))\
+        .params(category_id=category_id,
+                seed=seed,
+                count=count,
+                offset=offset)\
+        .first()
+
+
+def cached_term_from_category(category_id, seed, offset):
+    deck = decks.category_ids(category_id)
+    if offset >= len(deck):
+        return None
+    return Term.query.get(deck[permute(offset, len(deck), seed)])
+
+
+def measure(fn, category_id, offset, repeat):
+    started = default_timer()
+    for _ in range(repeat):
+        fn(category_id, SEED, offset)
+        db.session.expunge_all()
+    return (default_timer() - started) / repeat * 1000
+
+
+def main(category_id, repeat=20):
+    with app.app_context():
+        decks.cache.clear()
+        started = default_timer()
+        deck = decks.category_ids(category_id)
+        print('category {}: {} terms, cold deck build {:.2f} ms'.format(
+            category_id, len(deck), (default_timer() - started) * 1000))
+
+        print('{:>8} {:>12} {:>12}'.format('offset', 'sql (ms)', 'cache (ms)'))
+        for offset in OFFSETS:
+            print('{:>8} {:>12.3f} {:>12.3f}'.format(
+                offset,
+                measure(sql_term_from_category, category_id, offset, repeat),
+                measure(cached_term_from_category, category_id, offset, repeat)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]), *[int(arg) for arg in sys.argv[2:3]])
@@ -0,0 +1,85 @@
+"""
+Fuzzy search latency over a synthetic German-like vocabulary
+
+Queries are vocabulary words with umlauts spelled out or dropped and up to
+two random typos. Needs no database.
+
+Usage (from the project root):
+
+    python -m benchmarks.fuzzy_search [words] [queries]
+"""
+import sys
+from random import Random
+from timeit import default_timer
+
+from wordgameapi.fuzzy import FuzzyIndex, fold
+
+ONSETS = ['', 'b', 'br', 'ch', 'd', 'f', 'fl', 'g', 'gr', 'h', 'k', 'kl', 'l', 'm', 'n', 'p', 'pf', 'r',
+          's', 'sch', 'schw', 'sp', 'st', 'str', 't', 'tr', 'w', 'z', 'zw']
+NUCLEI = ['a', 'e', 'i', 'o', 'u', 'ä', 'ö', 'ü', 'au', 'ei', 'eu', 'ie']
+CODAS = ['', 'b', 'ch', 'ck', 'd', 'f', 'g', 'k', 'l', 'ld', 'm', 'n', 'nd', 'ng', 'nk', 'r', 'rt',
+         's', 'ß', 't', 'tz', 'st']
+SUFFIXES = ['', '', 'e', 'en', 'er', 'el', 'chen', 'ung', 'heit', 'keit', 'schaft', 'ling']
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+
+def vocabulary(size, random):
+    words = set()
+    while len(words) < size:
+        syllables = random.choice((1, 2, 2, 3, 3, 4))
+        word = ''.join(random.choice(ONSETS) + random.choice(NUCLEI) + random.choice(CODAS)
+                       for _ in range(syllables)) + random.choice(SUFFIXES)
+        if len(word) > 1:
+            words.add(word.capitalize())
+    return sorted(words)
+
+
+def misspell(word, random):
+    word = word.replace('ä', random.choice(('ae', 'a'))) \
+               .replace('ö', random.choice(('oe', 'o'))) \
+               .replace('ü', random.choice(('ue', 'u'))) \
+               .replace('ß', 'ss')
+    edits = random.choice((0, 1, 1, 2)) if len(word) > 5 else random.choice((0, 1))
+    for _ in range(edits):
+        position = random.randrange(len(word))
+        operation = random.choice(('insert', 'delete', 'replace'))
+        if operation == 'insert':
+            word = word[:position] + random.choice(LETTERS) + word[position:]
+        elif operation == 'delete' and len(word) > 3:
+            word = word[:position] + word[position + 1:]
+        else:
+            word = word[:position] + random.choice(LETTERS) + word[position + 1:]
+    return word
+
+
+def percentile(timings, fraction):
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+def main(size=500000, queries=2000):
+    random = Random(size)
+    words = vocabulary(size, random)
+    frequencies = {id_: random.randint(0, 1000) for id_ in range(len(words))}
+
+    started = default_timer()
+    index = FuzzyIndex([(id_, word) for id_, word in enumerate(words)], frequencies)
+    print('{} words indexed in {:.1f} s'.format(len(index), default_timer() - started))
+
+    samples = [random.choice(words) for _ in range(queries)]
+    timings = []
+    found = 0
+    for word in samples:
+        query = misspell(word, random)
+        started = default_timer()
+        matches = index.search(query, 10)
+        timings.append((default_timer() - started) * 1000)
+        found += any(fold(match[1]) == fold(word) for match in matches)
+
+    timings.sort()
+    print('{} queries: p50 {:.3f} ms, p90 {:.3f} ms, p99 {:.3f} ms, max {:.3f} ms, recall@10 {:.1%}'.format(
+        queries, percentile(timings, 0.5), percentile(timings, 0.9), percentile(timings, 0.99),
+        timings[-1], found / queries))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,35 @@
+"""
+Concurrent anonymous session starts against a slow reCAPTCHA
+
+Start `python stub_google.py 8090 <delay>` and the server under test with
+RECAPTCHA_VERIFY_URL pointing at the stub, then fire N requests at once. On
+the threaded server the wall time grows with N / threads * delay; on the ASGI
+app it stays close to one delay.
+
+Usage (from the project root):
+
+    python -m benchmarks.inflight [url] [requests]
+"""
+import sys
+import asyncio
+from collections import Counter
+from timeit import default_timer
+
+import httpx
+
+
+async def main(url='http://localhost:8080', requests=2000):
+    limits = httpx.Limits(max_connections=requests, max_keepalive_connections=0)
+    async with httpx.AsyncClient(base_url=url, timeout=300, limits=limits) as client:
+        started = default_timer()
+        responses = await asyncio.gather(*[client.post('/api/session', json=dict(recaptcha='human'))
+                                           for _ in range(requests)],
+                                         return_exceptions=True)
+        elapsed = default_timer() - started
+
+    statuses = Counter(getattr(response, 'status_code', type(response).__name__) for response in responses)
+    print('{} requests in {:.2f} s: {}'.format(requests, elapsed, dict(statuses)))
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main(*sys.argv[1:2], *[int(arg) for arg in sys.argv[2:3]]))
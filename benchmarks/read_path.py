@@ -0,0 +1,126 @@
+"""
+CPU per request of the hot GET endpoints: ORM hydration + stdlib JSON vs. Core read path + FastJSONEncoder
+
+Each pair builds the same response body both ways and checks the bytes are
+identical before timing.
+
+Usage (from the project root, against a populated database):
+
+    python -m benchmarks.read_path <user_id> <collection_id> <category_id> [repeat]
+"""
+import sys
+import json
+from time import process_time
+
+from flask.json import JSONEncoder
+
+from main import app
+from wordgameapi.models import db, Category, Collection, CollectionTerm, Term, PerformanceStat
+from wordgameapi.serialization import FastJSONEncoder, backend
+from wordgameapi import reads, search, term_store, decks
+from wordgameapi.shuffle import permute
+
+SEED = 42
+PAGE = 50
+
+
+def dumps(payload, encoder):
+    return json.dumps(payload, cls=encoder, sort_keys=True, separators=(',', ':'))
+
+
+def legacy_words(category_id):
+    deck = decks.category_ids(category_id)
+    term_ids = [deck[permute(position, len(deck), SEED)] for position in range(min(PAGE, len(deck)))]
+    terms = {term.id: term for term in Term.query.filter(Term.id.in_(term_ids))}
+    return dict(ok=True, terms=[terms[term_id] for term_id in term_ids if term_id in terms])
+
+
+def fast_words(category_id):
+    deck = decks.category_ids(category_id)
+    term_ids = [deck[permute(position, len(deck), SEED)] for position in range(min(PAGE, len(deck)))]
+    return dict(ok=True, terms=term_store.store().get_many(term_ids))
+
+
+def legacy_collection(user_id, collection_id):
+    collection = (db.session.query(Collection)
+                  .filter(Collection.owner_id == user_id, Collection.id == collection_id)
+                  .one())
+    rows = (db.session.query(Term)
+            .join(CollectionTerm, CollectionTerm.term_id == Term.id)
+            .filter(CollectionTerm.collection_id == collection.id)
+            .order_by(CollectionTerm.position, CollectionTerm.term_id)
+            .all())
+    return dict(ok=True, collection=dict(id=collection.id, name=collection.name, is_owned=True, terms=rows))
+
+
+def fast_collection(user_id, collection_id):
+    collection = reads.collection(user_id, collection_id)
+    term_ids = [term_id for term_id, in
+                (db.session.query(CollectionTerm.term_id)
+                 .filter(CollectionTerm.collection_id == collection['id'])
+                 .order_by(CollectionTerm.position, CollectionTerm.term_id))]
+    return dict(ok=True, collection=dict(id=collection['id'], name=collection['name'], is_owned=True,
+                                         terms=term_store.store().get_many(term_ids)))
+
+
+def legacy_categories():
+    return dict(ok=True, collections=db.session.query(Category).all())
+
+
+def fast_categories():
+    return dict(ok=True, collections=reads.categories())
+
+
+def legacy_worst(user_id):
+    rows = (db.session.query(PerformanceStat)
+            .from_statement(reads.WORST_PERFORMERS)
+            .params(user_id=user_id, week=0)
+            .all())
+    return dict(ok=True, report=dict(worst_performers=rows))
+
+
+def fast_worst(user_id):
+    return dict(ok=True, report=dict(worst_performers=reads.worst_performers(user_id, 0)))
+
+
+def search_payload():
+    terms, _ = search.indexes().prefix.search('Sch', search.SEARCH_MAX_LIMIT)
+    return dict(ok=True, terms=[dict(id=term_id, word=word) for term_id, word in terms], after=None)
+
+
+def run(build, encoder, repeat):
+    started = process_time()
+    for _ in range(repeat):
+        body = dumps(build(), encoder)
+        db.session.expunge_all()
+    return (process_time() - started) / repeat * 1000, body
+
+
+def main(user_id, collection_id, category_id, repeat=200):
+    collection_id, category_id, repeat = int(collection_id), int(category_id), int(repeat)
+    endpoints = [
+        ('GET /api/words?count={}'.format(PAGE),
+         lambda: legacy_words(category_id), lambda: fast_words(category_id)),
+        ('GET /api/me/collections/<id>',
+         lambda: legacy_collection(user_id, collection_id), lambda: fast_collection(user_id, collection_id)),
+        ('GET /api/collections', legacy_categories, fast_categories),
+        ('GET /api/stats?reports=worst', lambda: legacy_worst(user_id), lambda: fast_worst(user_id)),
+        ('GET /api/search (encoding only)', search_payload, search_payload),
+    ]
+
+    print('JSON backend: {}'.format(backend()))
+    with app.app_context():
+        # Warm up the term store, deck cache and search indexes
+        fast_words(category_id)
+        search_payload()
+
+        for name, legacy, fast in endpoints:
+            legacy_ms, legacy_body = run(legacy, JSONEncoder, repeat)
+            fast_ms, fast_body = run(fast, FastJSONEncoder, repeat)
+            print('{:<34} legacy {:7.3f} ms CPU, fast {:7.3f} ms CPU, {:5.1f}x, identical: {}'.format(
+                name, legacy_ms, fast_ms, legacy_ms / fast_ms if fast_ms > 0 else float('inf'),
+                legacy_body == fast_body))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:5])
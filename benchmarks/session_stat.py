@@ -0,0 +1,66 @@
+"""
+Latency budget of the /api/stats/<session_id> report on a 10k-answer session
+
+Seeds a throwaway session through the regular ingestion path, times the
+report and removes the session again. Exits with status 1 when the median
+exceeds the budget.
+
+Usage (from the project root, against a populated database):
+
+    python -m benchmarks.session_stat [budget_ms] [answers]
+"""
+import sys
+from random import Random
+from statistics import median
+from timeit import default_timer
+from uuid import uuid4
+
+from main import app
+from wordgameapi.models import db, Session, Term, TermStat
+from wordgameapi.stats import upsert_term_stats, session_report
+
+REPEAT = 50
+
+
+def seed_session(answers):
+    random = Random(answers)
+    session_id = str(uuid4())
+    db.session.add(Session(id=session_id, game_type='gender', cursor=''))
+    db.session.commit()
+
+    term_ids = [term_id for term_id, in db.session.query(Term.id).limit(answers)]
+    events = [dict(session_id=session_id,
+                   term_id=random.choice(term_ids),
+                   correct=random.random() < 0.7,
+                   seconds=random.randint(1, 20))
+              for _ in range(answers)]
+    for start in range(0, len(events), 1000):
+        upsert_term_stats(events[start:start + 1000], 0)
+    return session_id
+
+
+def main(budget_ms=50.0, answers=10000):
+    with app.app_context():
+        session_id = seed_session(answers)
+        try:
+            session_report(session_id)
+            timings = []
+            for _ in range(REPEAT):
+                started = default_timer()
+                session_report(session_id)
+                timings.append((default_timer() - started) * 1000)
+        finally:
+            db.session.query(TermStat).filter(TermStat.session_id == session_id).delete()
+            db.session.query(Session).filter(Session.id == session_id).delete()
+            db.session.commit()
+
+    timings.sort()
+    print('{} answers: median {:.2f} ms, max {:.2f} ms, budget {:.2f} ms'.format(
+        answers, median(timings), timings[-1], budget_ms))
+    return median(timings) <= budget_ms
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    ok = main(*[float(args[0])] if args else [], *[int(arg) for arg in args[1:2]])
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,64 @@
+"""
+Memory per term and get_many throughput of the array-backed TermStore vs. ORM Term instances
+
+Uses a synthetic vocabulary and transient Term instances, so it needs no database.
+
+Usage (from the project root):
+
+    python -m benchmarks.term_store [terms] [lookups]
+"""
+import sys
+import tracemalloc
+from random import Random
+from timeit import default_timer
+
+from wordgameapi.models import Term, GENDER_TAGS, NOUN_TAGS
+from wordgameapi.term_store import TermStore
+from benchmarks.fuzzy_search import vocabulary
+
+BATCH_SIZES = (1, 50)
+
+
+def measure(build):
+    """
+    :return: What `build` returned, and the bytes it left allocated
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def orm_get_many(terms, term_ids):
+    return [dict(id=term.id, word=term.word, tags=GENDER_TAGS.get(term.gender, NOUN_TAGS))
+            for term in (terms.get(term_id) for term_id in term_ids) if term is not None]
+
+
+def main(size=500000, lookups=200000):
+    random = Random(size)
+    rows = [(id_, word, random.choice((1, 2, 3, None))) for id_, word in enumerate(vocabulary(size, random), 1)]
+    # The words themselves are shared by both, only the structures around them are measured
+    rows = [(id_, sys.intern(word), gender) for id_, word, gender in rows]
+
+    store, store_bytes = measure(lambda: TermStore(rows))
+    orm, orm_bytes = measure(lambda: {id_: Term(id=id_, word=word, gender=gender) for id_, word, gender in rows})
+    print('{} terms: TermStore {:.1f} bytes/term, ORM Term {:.1f} bytes/term'.format(
+        len(rows), store_bytes / len(rows), orm_bytes / len(rows)))
+
+    for batch_size in BATCH_SIZES:
+        batches = [[random.randint(1, size) for _ in range(batch_size)]
+                   for _ in range(max(1, lookups // batch_size))]
+        for name, get_many in (('TermStore', store.get_many),
+                               ('ORM Term', lambda term_ids: orm_get_many(orm, term_ids))):
+            started = default_timer()
+            for term_ids in batches:
+                get_many(term_ids)
+            elapsed = default_timer() - started
+            print('get_many({:>2}) {:<9}: {:,.0f} terms/s'.format(
+                batch_size, name, len(batches) * batch_size / elapsed))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -6,30 +6,63 @@ from flask import Flask
 from flask_cors import CORS
 
 from wordgameapi.models import db
-from wordgameapi import handlers
+from wordgameapi import handlers, writebehind, instrumentation, profiling, querybudget, metrics
 from wordgameapi.auth import jwt
+from wordgameapi.serialization import FastJSONEncoder
+from wordgameapi.dbpool import TimedQueuePool
 
 DEBUG = os.getenv('DEBUG', False)
 DB_HOST = os.getenv('DB_HOST')
 DB_PORT = os.getenv('DB_PORT', '3306')
 DB_USER = os.getenv('DB_USER')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
+# Sized for the 30 CherryPy threads: pool_size connections kept open, up to max_overflow more under load
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_POOL_MAX_OVERFLOW = int(os.getenv('DB_POOL_MAX_OVERFLOW', 20))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+# Below MySQL's wait_timeout, so idle connections are replaced before the server drops them
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 3600))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') != '0'
 
 JWT_SECRET = os.getenv('JWT_SECRET', None)
 
 app = Flask(__name__)
+app.json_encoder = FastJSONEncoder
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = DEBUG != False
 app.config['SQLALCHEMY_DATABASE_URI'] = 'mysql+pymysql://{}:{}@{}:{}/wordgame'.format(DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(poolclass=TimedQueuePool,
+                                               pool_size=DB_POOL_SIZE,
+                                               max_overflow=DB_POOL_MAX_OVERFLOW,
+                                               pool_timeout=DB_POOL_TIMEOUT,
+                                               pool_recycle=DB_POOL_RECYCLE,
+                                               pool_pre_ping=DB_POOL_PRE_PING)
 app.config['JWT_AUTH_HEADER_PREFIX'] = 'Bearer'
 app.config['SECRET_KEY'] = JWT_SECRET
 
+instrumentation.init_app(app)
 db.init_app(app)
 jwt.init_app(app)
+writebehind.init_app(app)
+profiling.init_app(app)
+querybudget.init_app(app)
+metrics.init_app(app)
 CORS(app, resources={r'/api/*': {'origins': '*', 'supports_credential': True}})
 
 app.add_url_rule("/api/health-check", "health-check", methods=['GET'],
                  view_func=handlers.health_check)
+app.add_url_rule("/api/metrics", "metrics", methods=['GET'],
+                 view_func=handlers.get_metrics)
+app.add_url_rule("/api/admin/profiles", "list-profiles", methods=['GET'],
+                 view_func=handlers.list_profiles)
+app.add_url_rule("/api/admin/profiles", "reset-profiles", methods=['DELETE'],
+                 view_func=handlers.reset_profiles)
+app.add_url_rule("/api/admin/profiles/<endpoint>", "get-profile-dump", methods=['GET'],
+                 view_func=handlers.get_profile_dump)
+app.add_url_rule("/api/admin/slow-queries", "list-slow-queries", methods=['GET'],
+                 view_func=handlers.list_slow_queries)
+app.add_url_rule("/api/admin/slow-queries", "reset-slow-queries", methods=['DELETE'],
+                 view_func=handlers.reset_slow_queries)
 app.add_url_rule("/api/auth", "login", methods=['POST'],
                  view_func=handlers.login)
 app.add_url_rule("/api/auth", "get-profile", methods=['GET'],
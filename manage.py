@@ -2,7 +2,10 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
+from sqlalchemy.sql import text
 from wordgameapi.models import db
+from wordgameapi import dictionary, snapshot
+from wordgameapi.stats import bucket_for
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'mysql+pymysql://root:ILkopTAD2ut2exVEJUh5UjehL@f@localhost:3306/wordgame'
@@ -12,5 +15,94 @@ migrate = Migrate(app, db)
 manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
+
+@manager.command
+def refresh_dictionary():
+    """
+    Rebuild the noun dictionary and term frequencies after term/nomen/category updates
+    """
+    version = dictionary.refresh()
+    print('Dictionary refreshed to version {}'.format(version))
+
+
+@manager.command
+def build_snapshot(path):
+    """
+    Export the noun dictionary to the read-only snapshot file workers mmap (DICTIONARY_SNAPSHOT)
+    """
+    version = snapshot.build(path)
+    print('Snapshot of dictionary version {} written to {}'.format(version, path))
+
+
+@manager.command
+def backfill_performance():
+    """
+    Rebuild the term_performance rollup from term_stat
+
+    Replaces every row in one transaction, so it is safe to re-run.
+    """
+    db.session.execute(text("DELETE FROM `term_performance`"))
+    result = db.session.execute(text(
+        """
+        INSERT INTO `term_performance` (user_id, term_id, week, corrects, wrongs, seconds, seconds_correct)
+        SELECT S.user_id, TS.term_id, TS.week,
+            SUM(TS.corrects), SUM(TS.wrongs), SUM(TS.seconds), SUM(TS.seconds_correct)
+        FROM `term_stat` AS TS
+        JOIN `session` AS S ON S.id = TS.session_id
+        WHERE S.user_id IS NOT NULL
+        GROUP BY S.user_id, TS.term_id, TS.week
+        """
+    ))
+    db.session.commit()
+    print('{} term_performance rows written'.format(result.rowcount))
+
+
+@manager.command
+def backfill_histogram():
+    """
+    Rebuild answer_histogram from term_stat
+
+    term_stat only keeps sums, so the correct answers of a row are counted in
+    the bucket of their mean time (seconds_correct / corrects) and the other
+    answers in the bucket of theirs. Replaces every row in one transaction,
+    so it is safe to re-run.
+    """
+    rows = db.session.execute(text(
+        """
+        SELECT S.user_id, TS.week, TS.corrects, TS.wrongs, TS.skippeds, TS.seconds, TS.seconds_correct
+        FROM `term_stat` AS TS
+        JOIN `session` AS S ON S.id = TS.session_id
+        WHERE S.user_id IS NOT NULL
+        """
+    ))
+
+    histogram = dict()
+    for row in rows:
+        corrects = row['corrects']
+        others = row['wrongs'] + row['skippeds']
+        seconds_correct = row['seconds_correct'] or 0
+        if corrects > 0:
+            key = (row['user_id'], row['week'], bucket_for(seconds_correct / corrects))
+            correct_count, wrong_count = histogram.get(key, (0, 0))
+            histogram[key] = (correct_count + corrects, wrong_count)
+        if others > 0:
+            key = (row['user_id'], row['week'], bucket_for((row['seconds'] - seconds_correct) / others))
+            correct_count, wrong_count = histogram.get(key, (0, 0))
+            histogram[key] = (correct_count, wrong_count + others)
+
+    items = [dict(user_id=user_id, week=week, bucket=bucket, correct_count=counts[0], wrong_count=counts[1])
+             for (user_id, week, bucket), counts in histogram.items()]
+    db.session.execute(text("DELETE FROM `answer_histogram`"))
+    for start in range(0, len(items), 1000):
+        db.session.execute(text(
+            """
+            INSERT INTO `answer_histogram` (user_id, week, bucket, correct_count, wrong_count)
+            VALUES (:user_id, :week, :bucket, :correct_count, :wrong_count)
+            """
+        ), items[start:start + 1000])
+    db.session.commit()
+    print('{} answer_histogram rows written'.format(len(items)))
+
+
 if __name__ == '__main__':
     manager.run()
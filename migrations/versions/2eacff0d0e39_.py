@@ -0,0 +1,31 @@
+"""answer_histogram buckets
+
+Revision ID: 2eacff0d0e39
+Revises: 98862ddcd6cf
+Create Date: 2026-10-18 11:20:52.904117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2eacff0d0e39'
+down_revision = '98862ddcd6cf'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('answer_histogram',
+    sa.Column('user_id', sa.String(length=25), nullable=False),
+    sa.Column('week', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('bucket', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('correct_count', sa.Integer(), nullable=False),
+    sa.Column('wrong_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('user_id', 'week', 'bucket')
+    )
+
+
+def downgrade():
+    op.drop_table('answer_histogram')
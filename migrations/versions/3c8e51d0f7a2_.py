@@ -0,0 +1,36 @@
+"""term_frequency for search ranking
+
+Revision ID: 3c8e51d0f7a2
+Revises: 7d3f2c915e4a
+Create Date: 2026-10-18 19:12:48.530176
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c8e51d0f7a2'
+down_revision = '7d3f2c915e4a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('term_frequency',
+    sa.Column('term_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('answers', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('term_id')
+    )
+
+    # Initial load, later refreshes go through `python manage.py refresh_dictionary`
+    op.execute("""
+        INSERT INTO `term_frequency` (term_id, answers)
+        SELECT term_id, SUM(corrects + wrongs + skippeds)
+        FROM `term_stat`
+        GROUP BY term_id
+    """)
+
+
+def downgrade():
+    op.drop_table('term_frequency')
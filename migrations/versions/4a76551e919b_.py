@@ -0,0 +1,36 @@
+"""term_stat gender code
+
+Revision ID: 4a76551e919b
+Revises: 2eacff0d0e39
+Create Date: 2026-10-18 12:03:29.671240
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision = '4a76551e919b'
+down_revision = '2eacff0d0e39'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('term_stat', sa.Column('gender', mysql.TINYINT(), nullable=True, comment='Gender code of the term, see GENDER_TAGS'))
+    op.execute("""
+        UPDATE `term_stat` AS TS
+        JOIN (SELECT id, MIN(tags) AS tags FROM `term_view` GROUP BY id) AS T ON T.id = TS.term_id
+        SET TS.gender = CASE T.tags
+            WHEN 'SUB:NOM:SIN:MAS' THEN 1
+            WHEN 'SUB:NOM:SIN:FEM' THEN 2
+            WHEN 'SUB:NOM:SIN:NEU' THEN 3
+        END
+    """)
+    op.create_index('ix_term_stat_session_id_gender', 'term_stat', ['session_id', 'gender'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_term_stat_session_id_gender', table_name='term_stat')
+    op.drop_column('term_stat', 'gender')
@@ -0,0 +1,71 @@
+"""collection_term membership table
+
+Revision ID: 4ab62a9cc869
+Revises: 4a76551e919b
+Create Date: 2026-10-18 13:15:44.208913
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4ab62a9cc869'
+down_revision = '4a76551e919b'
+branch_labels = None
+depends_on = None
+
+collection_term = sa.table('collection_term',
+                           sa.column('collection_id', sa.Integer),
+                           sa.column('term_id', sa.Integer),
+                           sa.column('position', sa.Integer))
+
+
+def upgrade():
+    op.create_table('collection_term',
+    sa.Column('collection_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('term_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('collection_id', 'term_id')
+    )
+    op.create_index('ix_collection_term_collection_id_position', 'collection_term', ['collection_id', 'position', 'term_id'], unique=False)
+
+    connection = op.get_bind()
+    rows = []
+    for collection_id, term_ids in connection.execute(
+            sa.text("SELECT id, term_ids FROM `collection` WHERE term_ids IS NOT NULL")):
+        if isinstance(term_ids, str):
+            term_ids = json.loads(term_ids)
+        seen = set()
+        for term_id in term_ids or []:
+            # The old handler stored term ids untyped, so "123" and 123 may both be there
+            try:
+                term_id = int(term_id)
+            except (TypeError, ValueError):
+                continue
+            if term_id in seen:
+                continue
+            seen.add(term_id)
+            rows.append(dict(collection_id=collection_id, term_id=term_id, position=len(seen) - 1))
+    if rows:
+        op.bulk_insert(collection_term, rows)
+
+    op.drop_column('collection', 'term_ids')
+
+
+def downgrade():
+    op.add_column('collection', sa.Column('term_ids', sa.JSON(), nullable=True))
+
+    connection = op.get_bind()
+    term_ids = {}
+    for collection_id, term_id in connection.execute(
+            sa.text("SELECT collection_id, term_id FROM `collection_term` ORDER BY collection_id, position, term_id")):
+        term_ids.setdefault(collection_id, []).append(term_id)
+    for collection_id, ids in term_ids.items():
+        connection.execute(sa.text("UPDATE `collection` SET term_ids = :term_ids WHERE id = :id"),
+                           term_ids=json.dumps(ids), id=collection_id)
+
+    op.drop_index('ix_collection_term_collection_id_position', table_name='collection_term')
+    op.drop_table('collection_term')
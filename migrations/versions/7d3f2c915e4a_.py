@@ -0,0 +1,38 @@
+"""dense collection_term positions
+
+Revision ID: 7d3f2c915e4a
+Revises: b9755d244467
+Create Date: 2026-10-18 17:40:27.513964
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d3f2c915e4a'
+down_revision = 'b9755d244467'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Renumber every collection 0 to count - 1, keeping the order, before positions become unique
+    connection = op.get_bind()
+    positions = {}
+    for collection_id, term_id, position in connection.execute(
+            sa.text("SELECT collection_id, term_id, position FROM `collection_term` "
+                    "ORDER BY collection_id, position, term_id")):
+        dense = positions[collection_id] = positions.get(collection_id, -1) + 1
+        if dense != position:
+            connection.execute(sa.text("UPDATE `collection_term` SET position = :position "
+                                       "WHERE collection_id = :collection_id AND term_id = :term_id"),
+                               position=dense, collection_id=collection_id, term_id=term_id)
+
+    op.drop_index('ix_collection_term_collection_id_position', table_name='collection_term')
+    op.create_index('ux_collection_term_collection_id_position', 'collection_term', ['collection_id', 'position'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ux_collection_term_collection_id_position', table_name='collection_term')
+    op.create_index('ix_collection_term_collection_id_position', 'collection_term', ['collection_id', 'position', 'term_id'], unique=False)
@@ -0,0 +1,35 @@
+"""term_performance rollup
+
+Revision ID: 98862ddcd6cf
+Revises: c177bbe74e33
+Create Date: 2026-10-18 10:41:07.532981
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '98862ddcd6cf'
+down_revision = 'c177bbe74e33'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('term_performance',
+    sa.Column('user_id', sa.String(length=25), nullable=False),
+    sa.Column('term_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('week', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('corrects', sa.Integer(), nullable=False),
+    sa.Column('wrongs', sa.Integer(), nullable=False),
+    sa.Column('seconds', sa.Integer(), nullable=False),
+    sa.Column('seconds_correct', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('user_id', 'term_id', 'week')
+    )
+    op.create_index('ix_term_performance_user_id_week', 'term_performance', ['user_id', 'week'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_term_performance_user_id_week', table_name='term_performance')
+    op.drop_table('term_performance')
@@ -0,0 +1,71 @@
+"""materialized noun dictionary
+
+Revision ID: b9755d244467
+Revises: 4ab62a9cc869
+Create Date: 2026-10-18 14:02:11.845327
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9755d244467'
+down_revision = '4ab62a9cc869'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('noun',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('word', sa.String(length=80), nullable=False),
+    sa.Column('gender', mysql.TINYINT(), nullable=True),
+    sa.Column('normalized_word', sa.String(length=80), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_noun_gender'), 'noun', ['gender'], unique=False)
+    op.create_index(op.f('ix_noun_normalized_word'), 'noun', ['normalized_word'], unique=False)
+    op.create_table('category_noun',
+    sa.Column('category_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('noun_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.PrimaryKeyConstraint('category_id', 'noun_id')
+    )
+    op.create_index(op.f('ix_category_noun_noun_id'), 'category_noun', ['noun_id'], unique=False)
+    op.create_table('dictionary_version',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('refreshed_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    # Initial load, later refreshes go through `python manage.py refresh_dictionary`
+    op.execute("""
+        INSERT IGNORE INTO `noun` (id, word, gender, normalized_word)
+        SELECT `term`.id, word,
+            CASE SUBSTR(tags, 13, 3) WHEN 'MAS' THEN 1 WHEN 'FEM' THEN 2 WHEN 'NEU' THEN 3 END,
+            LOWER(word)
+        FROM `term` JOIN `nomen` ON word = form
+        WHERE SUBSTR(tags, 1, 11) = 'SUB:NOM:SIN'
+        ORDER BY `term`.id, tags
+    """)
+    op.execute("""
+        INSERT IGNORE INTO `category_noun` (category_id, noun_id)
+        SELECT C.id, `term`.id
+        FROM `category` AS C, `term` JOIN `nomen` ON word = form
+        WHERE SUBSTR(tags, 1, 11) = 'SUB:NOM:SIN'
+          AND synset_id in
+            (SELECT `synset_id` FROM `synset` AS S JOIN `category_link` AS CL ON S.id = CL.synset_id
+                WHERE CL.category_id = C.id)
+    """)
+    op.execute("INSERT INTO `dictionary_version` (id, version, refreshed_at) VALUES (1, 1, NOW())")
+
+
+def downgrade():
+    op.drop_table('dictionary_version')
+    op.drop_index(op.f('ix_category_noun_noun_id'), table_name='category_noun')
+    op.drop_table('category_noun')
+    op.drop_index(op.f('ix_noun_normalized_word'), table_name='noun')
+    op.drop_index(op.f('ix_noun_gender'), table_name='noun')
+    op.drop_table('noun')
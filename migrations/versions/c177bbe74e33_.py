@@ -0,0 +1,40 @@
+"""unique term_stat per session and term
+
+Revision ID: c177bbe74e33
+Revises: ab33d8711d64
+Create Date: 2026-10-18 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c177bbe74e33'
+down_revision = 'ab33d8711d64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Fold rows duplicated by concurrent inserts into the oldest one before enforcing uniqueness
+    op.execute("""
+        UPDATE `term_stat` AS TS
+        JOIN (SELECT MIN(id) AS id,
+                  SUM(corrects) AS corrects, SUM(wrongs) AS wrongs, SUM(skippeds) AS skippeds,
+                  SUM(seconds) AS seconds, SUM(seconds_correct) AS seconds_correct
+              FROM `term_stat`
+              GROUP BY session_id, term_id
+              HAVING COUNT(*) > 1) AS D ON D.id = TS.id
+        SET TS.corrects = D.corrects, TS.wrongs = D.wrongs, TS.skippeds = D.skippeds,
+            TS.seconds = D.seconds, TS.seconds_correct = D.seconds_correct
+    """)
+    op.execute("""
+        DELETE TS FROM `term_stat` AS TS
+        JOIN `term_stat` AS K ON K.session_id = TS.session_id AND K.term_id = TS.term_id AND K.id < TS.id
+    """)
+    op.create_index('ix_term_stat_session_id_term_id', 'term_stat', ['session_id', 'term_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_term_stat_session_id_term_id', table_name='term_stat')
@@ -0,0 +1,70 @@
+"""
+Local stand-in for the Google endpoints the API calls
+
+    POST /recaptcha/api/siteverify  succeeds unless the response token is "bot"
+    POST /token                     exchanges any code for a token whose id_token has sub=<code>
+
+Usage:
+
+    python stub_google.py [port] [delay_seconds]
+
+The delay simulates a slow Google. Point the API at the stub with
+RECAPTCHA_VERIFY_URL=http://localhost:<port>/recaptcha/api/siteverify and
+OAUTH_TOKEN_URI=http://localhost:<port>/token.
+"""
+import sys
+import json
+import time
+from base64 import urlsafe_b64encode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+def _segment(data):
+    return urlsafe_b64encode(json.dumps(data).encode('utf8')).rstrip(b'=').decode('ascii')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    delay = 0
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode('utf8')).items()}
+        time.sleep(self.delay)
+
+        if self.path == '/recaptcha/api/siteverify':
+            self._send(200, dict(success=form.get('response') != 'bot'))
+        elif self.path == '/token':
+            code = form.get('code')
+            if not code or code == 'invalid':
+                self._send(400, dict(error='invalid_grant'))
+                return
+            now = int(time.time())
+            id_token = '.'.join((_segment(dict(alg='none', typ='JWT')),
+                                 _segment(dict(sub=code, email='{}@example.com'.format(code),
+                                               iss='accounts.google.com', aud=form.get('client_id'),
+                                               iat=now, exp=now + 3600)),
+                                 ''))
+            self._send(200, dict(access_token='stub-access-token', token_type='Bearer',
+                                 expires_in=3600, id_token=id_token))
+        else:
+            self._send(404, dict(error='not_found'))
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8090
+    StubHandler.delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0
+    server = ThreadingHTTPServer(('0.0.0.0', port), StubHandler)
+    print('Stub Google listening on port {}'.format(port))
+    server.serve_forever()
@@ -0,0 +1,75 @@
+"""
+Query budgets of the hot endpoints, checked through the Flask test client
+
+With app.testing set a request over its budget raises QueryBudgetExceeded,
+so these fail as soon as a change adds statements to login, get_profile or
+next_word. They run against the database main.py is configured with, migrated
+and holding at least one category, and sign in through stub_google.py:
+
+    python stub_google.py 8001 &
+    OAUTH_TOKEN_URI=http://localhost:8001/token python -m unittest tests.test_query_budget
+"""
+import unittest
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import jwt
+from sqlalchemy.sql import text
+
+from main import app
+from wordgameapi import handlers
+from wordgameapi.models import db, Category
+from wordgameapi.querybudget import max_queries
+
+
+def _token(user_id):
+    iat = datetime.utcnow()
+    return jwt.encode(dict(sub=user_id, iat=iat, nbf=iat, exp=iat + timedelta(minutes=5)),
+                      handlers.JWT_SECRET, algorithm='HS256').decode()
+
+
+class QueryBudgetTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        app.testing = True
+        with app.app_context():
+            try:
+                db.session.execute(text('SELECT 1'))
+                cls.category_id = db.session.query(Category.id).order_by(Category.id).limit(1).scalar()
+            except Exception as e:
+                raise unittest.SkipTest('Database unavailable: {}'.format(e))
+            finally:
+                db.session.remove()
+
+    def setUp(self):
+        self.client = app.test_client()
+        # The stub signs in any access code as the user whose id is the code
+        self.user_id = 'query-budget-{}'.format(uuid4())
+
+    def test_login(self):
+        # A first sign-in creates the user and its default collection
+        with max_queries(4):
+            response = self.client.post('/api/auth', json=dict(access_code=self.user_id))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_json()['ok'])
+
+    def test_get_profile(self):
+        self.client.post('/api/auth', json=dict(access_code=self.user_id))
+
+        with max_queries(2):
+            response = self.client.get('/api/auth', headers=dict(Authorization='Bearer ' + _token(self.user_id)))
+        self.assertTrue(response.get_json()['ok'])
+
+    def test_next_word(self):
+        if self.category_id is None:
+            self.skipTest('No category to draw words from')
+        cursor = handlers._create_cursor(0, category_id=self.category_id)
+
+        with max_queries(4):
+            response = self.client.get('/api/words', query_string=dict(cursor=cursor, count=20),
+                                       headers=dict(Authorization='Bearer ' + _token(self.user_id)))
+        self.assertTrue(response.get_json()['ok'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,261 @@
+"""
+Async handlers for the routes that wait on Google
+
+Signing in exchanges the OAuth code and anonymous sessions verify a
+reCAPTCHA; on the threaded server each of those holds a worker thread for the
+whole round trip. These handlers await the calls with httpx and talk to MySQL
+through aiomysql, so one process can hold thousands of them in flight. They
+produce the same responses as their counterparts in handlers.
+"""
+import os
+import json
+import asyncio
+from datetime import datetime, timedelta
+from uuid import uuid4
+from random import randint
+
+import jwt
+import httpx
+from aiomysql.sa import create_engine
+from oauth2client.client import FlowExchangeError, _extract_id_token
+from sqlalchemy import select, func
+from starlette.responses import Response
+
+from .models import User, Collection, Session, Category
+from .serialization import FastJSONEncoder
+from .auth import identity as jwt_identity
+from .handlers import client, _create_cursor, JWT_SECRET
+from . import outbound
+
+DB_HOST = os.getenv('DB_HOST')
+DB_PORT = os.getenv('DB_PORT', '3306')
+DB_USER = os.getenv('DB_USER')
+DB_PASSWORD = os.getenv('DB_PASSWORD')
+ASYNC_DB_POOL_SIZE = int(os.getenv('ASYNC_DB_POOL_SIZE', 20))
+# Connections kept open to each external host
+ASYNC_HTTP_POOL_SIZE = int(os.getenv('ASYNC_HTTP_POOL_SIZE', 100))
+# Same defaults as flask_jwt
+JWT_LEEWAY = timedelta(seconds=10)
+JWT_OPTIONS = {
+    'verify_signature': True, 'verify_exp': True, 'verify_nbf': True, 'verify_iat': True,
+    'require_exp': True, 'require_iat': True, 'require_nbf': True,
+}
+
+_engine = None
+_http = None
+
+
+async def startup():
+    global _engine, _http
+    _engine = await create_engine(host=DB_HOST, port=int(DB_PORT), user=DB_USER, password=DB_PASSWORD,
+                                  db='wordgame', minsize=1, maxsize=ASYNC_DB_POOL_SIZE, autocommit=True)
+    _http = httpx.AsyncClient(timeout=httpx.Timeout(outbound.OUTBOUND_READ_TIMEOUT,
+                                                    connect=outbound.OUTBOUND_CONNECT_TIMEOUT),
+                              limits=httpx.Limits(max_connections=ASYNC_HTTP_POOL_SIZE,
+                                                  max_keepalive_connections=ASYNC_HTTP_POOL_SIZE))
+
+
+async def shutdown():
+    await _http.aclose()
+    _engine.close()
+    await _engine.wait_closed()
+
+
+def _jsonify(status_code=200, **kwargs):
+    """
+    Response encoded like flask.jsonify, including the CORS header flask_cors adds to /api/*
+    """
+    body = json.dumps(kwargs, cls=FastJSONEncoder, sort_keys=True, separators=(',', ':')) + '\n'
+    return Response(body, status_code=status_code, media_type='application/json',
+                    headers={'Access-Control-Allow-Origin': '*'})
+
+
+async def _json_body(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        return {}
+    return body if isinstance(body, dict) else {}
+
+
+def _current_identity(request):
+    """
+    :return: Identity of the bearer token as handled by flask_jwt, None without a valid token
+    """
+    prefix, _, token = request.headers.get('Authorization', '').partition(' ')
+    if prefix.lower() != 'bearer' or len(token) == 0:
+        return None
+    try:
+        payload = jwt.decode(token, JWT_SECRET, options=JWT_OPTIONS, algorithms=['HS256'], leeway=JWT_LEEWAY)
+    except jwt.InvalidTokenError:
+        return None
+    return jwt_identity(payload)
+
+
+async def _post(breaker, url, data):
+    """
+    Async counterpart of outbound.request, sharing its circuit breakers, retry policy and backoff
+
+    :raise outbound.Unavailable: On timeouts, connection and server errors left after retries
+    """
+    if not breaker.allow():
+        raise outbound.Unavailable('{} circuit is open'.format(breaker.name))
+
+    for attempt in range(outbound.OUTBOUND_RETRIES + 1):
+        if attempt > 0:
+            await asyncio.sleep(outbound.backoff(attempt))
+        try:
+            response = await _http.post(url, data=data)
+        except (httpx.ConnectTimeout, httpx.ConnectError) as e:
+            # The connection was never established, so Google cannot have received the request
+            error = e
+            continue
+        except httpx.HTTPError as e:
+            breaker.failure()
+            raise outbound.Unavailable('{}: {}'.format(breaker.name, e)) from e
+
+        if response.status_code in outbound.RETRY_STATUSES:
+            error = 'HTTP {}'.format(response.status_code)
+            continue
+        if response.status_code >= 500:
+            breaker.failure()
+            raise outbound.Unavailable('{}: HTTP {}'.format(breaker.name, response.status_code))
+        breaker.success()
+        return response
+
+    breaker.failure()
+    raise outbound.Unavailable('{}: {}'.format(breaker.name, error))
+
+
+async def _exchange(code):
+    """
+    Async equivalent of client.step2_exchange(code)
+
+    :return: Claims of the id_token
+    """
+    if code is None:
+        raise ValueError('No code provided.')
+
+    response = await _post(outbound.oauth_breaker, client.token_uri, dict(grant_type='authorization_code',
+                                                                          client_id=client.client_id,
+                                                                          client_secret=client.client_secret,
+                                                                          code=code,
+                                                                          redirect_uri=client.redirect_uri,
+                                                                          scope=client.scope))
+    try:
+        result = response.json()
+    except ValueError:
+        raise FlowExchangeError('Invalid response: {}'.format(response.status_code))
+    if response.status_code != 200 or 'access_token' not in result or 'id_token' not in result:
+        raise FlowExchangeError(result.get('error', 'Invalid response: {}'.format(response.status_code)))
+    return _extract_id_token(result['id_token'])
+
+
+async def _is_human(captcha_response):
+    result = outbound.verified_tokens.get(captcha_response)
+    if result is None:
+        response = await _post(outbound.recaptcha_breaker, outbound.RECAPTCHA_VERIFY_URL,
+                               {'response': captcha_response, 'secret': outbound.RECAPTCHA_SECRET})
+        result = bool(response.json().get('success'))
+        outbound.verified_tokens.set(captcha_response, result)
+    return result
+
+
+async def _get_random_category_id(connection):
+    count = await connection.scalar(select([func.count(Category.id)]))
+    result = await connection.execute(select([Category.id]).offset(randint(0, count - 1)).limit(1))
+    return (await result.first())[0]
+
+
+async def health_check(request):
+    return Response('ok', status_code=200, media_type='text/html')
+
+
+async def login(request):
+    access_code = (await _json_body(request)).get('access_code')
+
+    try:
+        id_token = await _exchange(access_code)
+    except (FlowExchangeError, ValueError):
+        return _jsonify(400, ok=False)
+    except outbound.Unavailable:
+        return _jsonify(503, ok=False, error='Sign-in unavailable')
+    user_id = id_token['sub']
+
+    async with _engine.acquire() as connection:
+        async with connection.begin():
+            user = await (await connection.execute(select([User.user_id])
+                                                   .where(User.user_id == user_id))).first()
+            if user is None:
+                await connection.execute(User.__table__.insert().values(user_id=user_id, provider='GOOGLE'))
+                await connection.execute(Collection.__table__.insert().values(owner_id=user_id, name='Default'))
+
+        collection = await (await connection.execute(
+            select([Collection.id, Collection.name])
+            .where(Collection.owner_id == user_id)
+            .where(Collection.name == 'Default'))).first()
+
+    iat = datetime.utcnow()
+    token = jwt.encode(dict(sub=user_id,
+                            iat=iat,
+                            nbf=iat + timedelta(seconds=5),
+                            exp=iat + timedelta(hours=1)
+                            ),
+                       JWT_SECRET, algorithm='HS256')
+
+    return _jsonify(ok=True,
+                    profile=id_token,
+                    default_collection=dict(id=collection[0], name=collection[1]),
+                    token=token.decode())
+
+
+async def create_game_session(request):
+    body = await _json_body(request)
+    identity = None
+    token = None
+    current_identity = _current_identity(request)
+    anonymous = current_identity is None or current_identity[0] == 'session'
+
+    if anonymous:
+        recaptcha_token = body.get('recaptcha')
+
+        if recaptcha_token is None:
+            return _jsonify(400, ok=False, error='Recaptcha missing')
+
+        # No database connection is held while waiting on Google
+        try:
+            human = await _is_human(recaptcha_token)
+        except outbound.Unavailable:
+            return _jsonify(503, ok=False, error='Recaptcha unavailable')
+        if not human:
+            return _jsonify(400, ok=False, error='Bad recaptcha')
+    else:
+        user_or_session, identity = current_identity
+
+    async with _engine.acquire() as connection:
+        category_id = await _get_random_category_id(connection) if anonymous else body.get('category_id')
+        cursor = _create_cursor(0,
+                                collection_id=body.get('collection_id'),
+                                category_id=category_id)
+
+        session_id = str(uuid4())
+        await connection.execute(Session.__table__.insert().values(id=session_id,
+                                                                   game_type='gender',
+                                                                   user_id=identity,
+                                                                   cursor=cursor,
+                                                                   status=Session.STATUS_PLAYING,
+                                                                   created_at=func.now()))
+
+    if identity is None:
+        iat = datetime.utcnow()
+        token = jwt.encode(dict(sub='session:{}'.format(session_id),
+                                iat=iat,
+                                nbf=iat + timedelta(seconds=5),
+                                exp=iat + timedelta(minutes=10)
+                                ),
+                           JWT_SECRET, algorithm='HS256').decode()
+
+    return _jsonify(201,
+                    ok=True,
+                    session=dict(id=session_id, cursor=cursor),
+                    token=token)
@@ -1,4 +1,7 @@
-from flask_jwt import JWT
+from flask_jwt import JWT, _default_jwt_decode_handler
+
+from .instrumentation import phase
+
 
 def identity(payload):
     """
@@ -13,3 +16,9 @@ def identity(payload):
 
 jwt = JWT(authentication_handler=lambda: True,
           identity_handler=identity)
+
+
+@jwt.jwt_decode_handler
+def decode(token):
+    with phase('auth'):
+        return _default_jwt_decode_handler(token)
@@ -0,0 +1,60 @@
+"""
+Instrumented SQLAlchemy connection pool
+
+TimedQueuePool is a QueuePool that records how long checkouts wait, how
+often they time out and how many connections are opened beyond pool_size;
+connections in use, idle and in overflow are read from the live pools at
+scrape time.
+"""
+from timeit import default_timer
+from weakref import WeakSet
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+from .metrics import Counter, Gauge, Histogram
+
+CHECKOUT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+_pools = WeakSet()
+
+
+def _pool_gauge(read):
+    return lambda: {(): sum(read(pool) for pool in list(_pools))}
+
+
+checkout_seconds = Histogram('db_pool_checkout_seconds',
+                             'Time spent waiting for a connection from the pool, including connecting',
+                             buckets=CHECKOUT_BUCKETS)
+checkout_timeouts = Counter('db_pool_checkout_timeouts_total',
+                            'Checkouts that gave up after pool_timeout')
+overflows = Counter('db_pool_overflow_total',
+                    'Connections opened beyond pool_size')
+Gauge('db_pool_checked_out', 'Connections in use', callback=_pool_gauge(lambda pool: pool.checkedout()))
+Gauge('db_pool_idle', 'Connections idle in the pool', callback=_pool_gauge(lambda pool: pool.checkedin()))
+Gauge('db_pool_overflow', 'Connections currently open beyond pool_size',
+      callback=_pool_gauge(lambda pool: max(0, pool.overflow())))
+Gauge('db_pool_size', 'Configured pool_size', callback=_pool_gauge(lambda pool: pool.size()))
+
+
+class TimedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # engine.dispose() replaces the pool, the old one drops out once collected
+        _pools.add(self)
+
+    def _do_get(self):
+        started = default_timer()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            checkout_timeouts.inc()
+            raise
+        finally:
+            checkout_seconds.observe((), default_timer() - started)
+
+    def _inc_overflow(self):
+        incremented = super()._inc_overflow()
+        if incremented and self._overflow > 0:
+            overflows.inc()
+        return incremented
@@ -0,0 +1,124 @@
+import os
+from array import array
+from collections import OrderedDict
+from threading import Lock
+
+from sqlalchemy.sql import text, func
+
+from .models import db, CollectionTerm
+from . import dictionary, snapshot, sharedcache
+
+# Upper bound on the number of term ids held by the deck cache of one process
+DECK_CACHE_MAX_IDS = int(os.getenv('DECK_CACHE_MAX_IDS', 2000000))
+
+
+class DeckCache:
+    """
+    Size-bounded LRU of term id arrays
+
+    The bound is the total number of ids held, not the number of decks, so a
+    handful of huge categories cannot push the process out of memory.
+    """
+    def __init__(self, max_ids):
+        self.max_ids = max_ids
+        self.size = 0
+        self._decks = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, build):
+        with self._lock:
+            deck = self._decks.get(key)
+            if deck is not None:
+                self._decks.move_to_end(key)
+                return deck
+
+        # Build outside of the lock, a concurrent miss only costs a duplicate build
+        deck = build()
+
+        with self._lock:
+            if key not in self._decks:
+                self._decks[key] = deck
+                self.size += len(deck)
+            while self.size > self.max_ids and len(self._decks) > 1:
+                _, evicted = self._decks.popitem(last=False)
+                self.size -= len(evicted)
+        return deck
+
+    def clear(self):
+        with self._lock:
+            self._decks.clear()
+            self.size = 0
+
+
+cache = DeckCache(DECK_CACHE_MAX_IDS)
+
+
+def _load_category_ids(category_id):
+    rows = db.session.execute(text(
+        """
+        SELECT noun_id FROM `category_noun`
+        WHERE category_id = :category_id
+        ORDER BY noun_id
+        """
+        ),
+        dict(category_id=category_id))
+    return array('i', (row[0] for row in rows))
+
+
+def category_ids(category_id):
+    """
+    :return: Term ids of the category in ascending order
+    """
+    dictionary_snapshot = snapshot.current()
+    if dictionary_snapshot is not None:
+        return dictionary_snapshot.category_ids(category_id)
+
+    generation = sharedcache.current()
+    if generation is not None:
+        deck = generation.deck(category_id)
+        if deck is not None:
+            return deck
+
+    return cache.get(('category', category_id, dictionary.version()),
+                     lambda: _load_category_ids(category_id))
+
+
+class CollectionDeck:
+    """
+    Term ids of a collection in position order, looked up by position through
+    the unique (collection_id, position) key rather than loaded as a whole;
+    positions are dense, so the index of a term is its position
+    """
+    def __init__(self, collection_id):
+        self.collection_id = collection_id
+        self._count = None
+
+    def __len__(self):
+        if self._count is None:
+            self._count = (db.session.query(func.coalesce(func.max(CollectionTerm.position) + 1, 0))
+                           .filter(CollectionTerm.collection_id == self.collection_id)
+                           .scalar())
+        return self._count
+
+    def __getitem__(self, index):
+        return (db.session.query(CollectionTerm.term_id)
+                .filter(CollectionTerm.collection_id == self.collection_id,
+                        CollectionTerm.position == index)
+                .scalar())
+
+    def take(self, indexes):
+        """
+        :return: Term ids at `indexes`, read with a single `position IN (...)` query
+        """
+        if len(indexes) == 0:
+            return []
+        term_ids = dict(db.session.query(CollectionTerm.position, CollectionTerm.term_id)
+                        .filter(CollectionTerm.collection_id == self.collection_id,
+                                CollectionTerm.position.in_(set(indexes))))
+        return [term_ids[index] for index in indexes if index in term_ids]
+
+
+def take(deck, indexes):
+    if isinstance(deck, CollectionDeck):
+        return deck.take(indexes)
+    return [deck[index] for index in indexes]
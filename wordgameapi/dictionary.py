@@ -0,0 +1,117 @@
+"""
+Materialized noun dictionary
+
+`noun` and `category_noun` are rebuilt from `term`, `nomen` and the category
+links into shadow tables, then swapped in with one atomic RENAME TABLE so
+readers never see a partial dictionary. `term_frequency`, the answers per
+term used to rank search results, is rebuilt and swapped in with them, so
+workers rebuilding their indexes read it instead of each aggregating
+`term_stat`. Every refresh bumps `dictionary_version`, which keys the
+in-process caches built from it.
+"""
+import os
+from threading import Lock
+from timeit import default_timer
+
+from sqlalchemy.sql import text
+
+from .models import db, Term
+
+# Seconds a process trusts its last read of dictionary_version
+DICTIONARY_VERSION_TTL = float(os.getenv('DICTIONARY_VERSION_TTL', 60))
+
+NOUN_INSERT = """
+    INSERT IGNORE INTO `{table}` (id, word, gender, normalized_word)
+    SELECT `term`.id, word,
+        CASE SUBSTR(tags, 13, 3) WHEN 'MAS' THEN 1 WHEN 'FEM' THEN 2 WHEN 'NEU' THEN 3 END,
+        LOWER(word)
+    FROM `term` JOIN `nomen` ON word = form
+    WHERE SUBSTR(tags, 1, 11) = 'SUB:NOM:SIN'
+    ORDER BY `term`.id, tags
+"""
+
+CATEGORY_NOUN_INSERT = """
+    INSERT IGNORE INTO `{table}` (category_id, noun_id)
+    SELECT C.id, `term`.id
+    FROM `category` AS C, `term` JOIN `nomen` ON word = form
+    WHERE SUBSTR(tags, 1, 11) = 'SUB:NOM:SIN'
+      AND synset_id in
+        (SELECT `synset_id` FROM `synset` AS S JOIN `category_link` AS CL ON S.id = CL.synset_id
+            WHERE CL.category_id = C.id)
+"""
+
+TERM_FREQUENCY_INSERT = """
+    INSERT INTO `{table}` (term_id, answers)
+    SELECT term_id, SUM(corrects + wrongs + skippeds)
+    FROM `term_stat`
+    GROUP BY term_id
+"""
+
+_lock = Lock()
+_version = None
+_checked_at = None
+
+
+def version():
+    """
+    :return: Current dictionary version, re-read at most every DICTIONARY_VERSION_TTL seconds
+    """
+    global _version, _checked_at
+    now = default_timer()
+    if _checked_at is not None and now - _checked_at < DICTIONARY_VERSION_TTL:
+        return _version
+
+    with _lock:
+        if _checked_at is None or now - _checked_at >= DICTIONARY_VERSION_TTL:
+            _version = db.session.execute(text(
+                "SELECT version FROM `dictionary_version` WHERE id = 1")).scalar() or 0
+            _checked_at = now
+    return _version
+
+
+def nouns():
+    """
+    :return: (id, word, gender) of every noun, by id
+    """
+    return (db.session.query(Term.id, Term.word, Term.gender)
+            .order_by(Term.id)
+            .all())
+
+
+def frequencies():
+    """
+    :return: Answers recorded per term id as of the last refresh, a popularity measure for ranking
+    """
+    return dict(db.session.execute(text("SELECT term_id, answers FROM `term_frequency`")))
+
+
+def refresh():
+    """
+    Rebuild `noun` and `category_noun` and swap them in atomically
+
+    :return: New dictionary version
+    """
+    connection = db.engine.connect()
+    try:
+        connection.execute(text("DROP TABLE IF EXISTS `noun_next`, `category_noun_next`, `term_frequency_next`"))
+        connection.execute(text("CREATE TABLE `noun_next` LIKE `noun`"))
+        connection.execute(text("CREATE TABLE `category_noun_next` LIKE `category_noun`"))
+        connection.execute(text("CREATE TABLE `term_frequency_next` LIKE `term_frequency`"))
+        connection.execute(text(NOUN_INSERT.format(table='noun_next')))
+        connection.execute(text(CATEGORY_NOUN_INSERT.format(table='category_noun_next')))
+        connection.execute(text(TERM_FREQUENCY_INSERT.format(table='term_frequency_next')))
+        connection.execute(text(
+            """
+            RENAME TABLE `noun` TO `noun_old`, `noun_next` TO `noun`,
+                `category_noun` TO `category_noun_old`, `category_noun_next` TO `category_noun`,
+                `term_frequency` TO `term_frequency_old`, `term_frequency_next` TO `term_frequency`
+            """))
+        connection.execute(text("DROP TABLE `noun_old`, `category_noun_old`, `term_frequency_old`"))
+        connection.execute(text(
+            """
+            INSERT INTO `dictionary_version` (id, version, refreshed_at) VALUES (1, 1, NOW())
+            ON DUPLICATE KEY UPDATE version = version + 1, refreshed_at = NOW()
+            """))
+        return connection.execute(text("SELECT version FROM `dictionary_version` WHERE id = 1")).scalar()
+    finally:
+        connection.close()
@@ -0,0 +1,165 @@
+"""
+Typo- and umlaut-tolerant word search
+
+Words and queries are folded (lower case, ä/ö/ü to ae/oe/ue, ß to ss), so
+"Maedchen" and "Strasse" match exactly and "Madchen" is one edit away.
+Candidates come from a trigram inverted index partitioned by word length and
+are filtered with the q-gram lemma: a word within edit distance k of the
+query shares at least (distinct query trigrams - 3k) trigrams with it, which
+also allows skipping the longest posting lists entirely. Posting lists are
+counted rarest first and counting stops after MAX_POSTINGS entries, which
+bounds the cost of short queries whose threshold is too low to skip much. At
+most MAX_CANDIDATES survivors, those with the largest overlap, are verified
+with a banded Levenshtein distance and ranked by distance, then frequency.
+"""
+from array import array
+from collections import Counter
+from heapq import nsmallest, nlargest
+from operator import itemgetter
+
+FOLDS = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss'})
+PAD = '\x00\x00'
+Q = 3
+# Trigrams a candidate must share with the query among the rarest ones counted
+MIN_SHARED = 3
+# Posting entries counted per query, the lists beyond are skipped and lower the threshold
+MAX_POSTINGS = 10000
+# Candidates verified with the edit distance per query
+MAX_CANDIDATES = 50
+
+
+def fold(word):
+    return word.lower().translate(FOLDS)
+
+
+def max_distance(length):
+    """
+    Edits tolerated for a folded query of `length` characters
+    """
+    if length <= 2:
+        return 0
+    if length <= 5:
+        return 1
+    return 2
+
+
+def trigrams(key):
+    padded = PAD + key + PAD
+    return {padded[i:i + Q] for i in range(len(padded) - Q + 1)}
+
+
+def distance(a, b, limit):
+    """
+    Levenshtein distance of `a` and `b`, or limit + 1 once it is known to exceed `limit`
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if len(a) > len(b):
+        a, b = b, a
+
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i] + [limit + 1] * len(b)
+        low = max(1, i - limit)
+        high = min(len(b), i + limit)
+        best = current[0] if low == 1 else limit + 1
+        for j in range(low, high + 1):
+            cost = previous[j - 1] + (char_a != b[j - 1])
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            current[j] = cost
+            if cost < best:
+                best = cost
+        if best > limit:
+            return limit + 1
+        previous = current
+    return min(previous[len(b)], limit + 1)
+
+
+class FuzzyIndex:
+    __slots__ = ('keys', 'ids', 'words', 'frequencies', 'postings', 'by_key')
+
+    def __init__(self, rows, frequencies=None):
+        """
+        :param rows: (id, word, ...) tuples
+        :param frequencies: Optional mapping of id to frequency, used as tie breaker
+        """
+        frequencies = frequencies or {}
+        self.keys = []
+        self.ids = array('i')
+        self.words = []
+        self.frequencies = array('I')
+        self.by_key = dict()
+        # trigram -> key length -> entry positions
+        self.postings = dict()
+
+        for position, row in enumerate(rows):
+            id_, word = row[0], row[1]
+            key = fold(word)
+            self.keys.append(key)
+            self.ids.append(id_)
+            self.words.append(word)
+            self.frequencies.append(min(int(frequencies.get(id_, 0)), 0xFFFFFFFF))
+            self.by_key.setdefault(key, []).append(position)
+            for gram in trigrams(key):
+                self.postings.setdefault(gram, {}).setdefault(len(key), array('I')).append(position)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _candidates(self, key, limit):
+        grams = trigrams(key)
+        threshold = len(grams) - Q * limit
+        lengths = range(len(key) - limit, len(key) + limit + 1)
+
+        lists = []
+        for gram in grams:
+            by_length = self.postings.get(gram, {})
+            positions = [by_length[length] for length in lengths if length in by_length]
+            lists.append((sum(len(item) for item in positions), positions))
+
+        # A candidate sharing `threshold` trigrams shares at least threshold - s of
+        # them outside the s longest posting lists, so those need not be counted
+        lists.sort(key=itemgetter(0))
+        counted = len(lists) - max(0, threshold - MIN_SHARED)
+        total = 0
+        for i in range(1, counted):
+            total += lists[i - 1][0]
+            if total + lists[i][0] > MAX_POSTINGS:
+                counted = i
+                break
+        threshold = max(1, threshold - (len(lists) - counted))
+
+        counts = Counter()
+        for _, positions in lists[:counted]:
+            for item in positions:
+                counts.update(item)
+
+        # Common suffixes (-ung, -heit, -schaft) let thousands of words pass the
+        # filter; the ones sharing most of the rarest trigrams are the close ones
+        best = nlargest(MAX_CANDIDATES, counts.items(), key=itemgetter(1))
+        return [position for position, count in best if count >= threshold]
+
+    def search(self, query, limit):
+        """
+        :return: Up to `limit` (id, word, distance) matches, closest and most frequent first
+        """
+        key = fold(query.strip())
+        if len(key) == 0:
+            return []
+        tolerance = max_distance(len(key))
+
+        matches = [(0, position) for position in self.by_key.get(key, ())]
+        if tolerance > 0:
+            for position in self._candidates(key, tolerance):
+                if self.keys[position] == key:
+                    continue
+                edits = distance(key, self.keys[position], tolerance)
+                if edits <= tolerance:
+                    matches.append((edits, position))
+
+        best = nsmallest(limit, matches,
+                         key=lambda match: (match[0], -self.frequencies[match[1]], self.keys[match[1]]))
+        return [(self.ids[position], self.words[position], edits) for edits, position in best]
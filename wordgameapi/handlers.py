@@ -1,38 +1,52 @@
 import os
+import hmac
 import json
-from math import sin, floor
-from functools import reduce
+import zlib
 from datetime import datetime, timedelta
 from base64 import b64encode, b64decode
 from random import randint
 
 from flask import make_response, jsonify, request
 from uuid import uuid4
+from sqlalchemy import tuple_
 from sqlalchemy.sql import text
 from oauth2client.client import flow_from_clientsecrets, FlowExchangeError
 from flask_jwt import jwt_required, current_identity, _jwt_required
 import jwt
-import requests
 
 from .models import (
-    db, Session, Category, Term, User, Collection,
-    TermStat, WeeklyTermStat, PerformanceStat,
+    db, Session, Category, User, Collection, CollectionTerm,
 )
+from .decks import category_ids, CollectionDeck, take
+from .shuffle import new_seed, permute
+from .stats import upsert_term_stats, session_report, valid_event, valid_term_id
+from .querybudget import query_budget
+from . import writebehind, search, term_store, reads, sharedcache, outbound, metrics, profiling, slowlog
 
 JWT_SECRET = os.getenv('JWT_SECRET', None)
-RECAPTCHA_SECRET = os.getenv('RECAPTCHA_SECRET', None)
+# Overrides the token endpoint of client_secret.json, e.g. to run against a stub server
+OAUTH_TOKEN_URI = os.getenv('OAUTH_TOKEN_URI', None)
 MAX_COLLECTION_COUNT = os.getenv('MAX_COLLECTION_COUNT', 10)
+MAX_WORDS_PER_PAGE = int(os.getenv('MAX_WORDS_PER_PAGE', 50))
+# Limit on decompressed request bodies
+MAX_BODY_SIZE = int(os.getenv('MAX_BODY_SIZE', 1024 * 1024))
+# Bearer token required by /api/metrics when set
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', None)
+# Comma separated IDs of the users allowed on /api/admin
+ADMIN_USER_IDS = set(filter(None, os.getenv('ADMIN_USER_IDS', '').split(',')))
 
 client = flow_from_clientsecrets('./client_secret.json',
                                  scope='email profile openid',
                                  redirect_uri='postmessage') # WTF-postmessage?!
+if OAUTH_TOKEN_URI is not None:
+    client.token_uri = OAUTH_TOKEN_URI
 
 EPOCH = datetime(1970, 1, 1)
 
 
 def _create_cursor(offset, seed=None, collection_id=None, category_id=None):
     if seed is None:
-        seed = randint(1, 100)
+        seed = new_seed()
     if collection_id is None and category_id is None:
         raise ValueError('Invalid param')
 
@@ -46,80 +60,131 @@ def _create_cursor(offset, seed=None, collection_id=None, category_id=None):
                                          offset=offset)).encode('utf8')).decode('utf8')
 
 
-def _term_from_category(category_id, seed, offset):
-    count_query = db.engine.execute(text(
-        """
-        SELECT COUNT(x.id) AS count_ FROM (
-            SELECT DISTINCT `term`.id, word, tags FROM `term`
-                  LEFT JOIN `nomen` ON word = form
-                WHERE SUBSTR(tags, 1, 11) = 'SUB:NOM:SIN'
-                  AND synset_id in
-                    (SELECT `synset_id` FROM `synset` AS S JOIN `category_link` AS CL ON S.id = CL.synset_id
-                        JOIN `category` AS C ON C.id = CL.category_id
-                        WHERE C.id = :category_id)
-        ) AS x
-        """
-        ),
-        category_id=category_id)
-    count = list(count_query)[0]['count_']
+def _get_terms(term_ids):
+    """
+    :return: Terms of `term_ids` in the same order, from the in-process term store
+    """
+    return term_store.store().get_many(term_ids)
 
-    return db.session.query(Term)\
-        .from_statement(text(
-            """
-            SELECT DISTINCT `term`.id, word, tags, MOD(`term`.id, SIN(:seed) * :count -  FLOOR(SIN(:seed) * :count)) AS r
-            FROM `term` LEFT JOIN `nomen` ON word = form
-            WHERE SUBSTR(tags, 1, 11) = 'SUB:NOM:SIN'
-              AND synset_id in
-                (SELECT `synset_id` FROM `synset` AS S JOIN `category_link` AS CL ON S.id = CL.synset_id
-                    JOIN `category` AS C ON C.id = CL.category_id
-                    WHERE C.id = :category_id)
-            ORDER BY r
-            LIMIT 1 OFFSET :offset
-            """
-        ))\
-        .params(category_id=category_id,
-                seed=seed,
-                count=count,
-                offset=offset)\
-        .first()
-
-
-def _term_from_collection(collection_id, seed, offset):
-    collection = Collection.query.get(collection_id)
-    count = len(collection.term_ids)
-    if offset >= count:
+
+def _term_from_deck(deck, seed, offset):
+    """
+    :param deck: Term ids in storage order, an array or a CollectionDeck
+    :return: Term at `offset` in the order of `seed`
+    """
+    if offset >= len(deck):
         return None
 
-    data = sorted([(i, i % ((sin(seed) * count) - floor(sin(seed) * count))) for i in range(0, count)],
-                  key=lambda item: item[1])
-    selected_term_id = collection.term_ids[data[offset][0]]
-    term = Term.query.get(selected_term_id)
+    terms = _get_terms([deck[permute(offset, len(deck), seed)]])
+    return terms[0] if len(terms) > 0 else None
 
-    return term
+
+def _terms_from_deck(deck, seed, offset, count):
+    """
+    :return: Up to `count` terms from `offset` on in the order of `seed`
+    """
+    term_ids = take(deck, [permute(position, len(deck), seed)
+                           for position in range(offset, min(offset + count, len(deck)))])
+    if len(term_ids) == 0:
+        return []
+
+    return _get_terms(term_ids)
 
 
 def is_human(captcha_response):
-    payload = {'response': captcha_response, 'secret': RECAPTCHA_SECRET}
-    response = requests.post("https://www.google.com/recaptcha/api/siteverify", payload)
-    response_text = json.loads(response.text)
-    return response_text['success']
+    return outbound.verify_recaptcha(captcha_response)
 
 
 def health_check():
     return make_response("ok", 200)
 
 
+def get_metrics():
+    # Bytes on both sides: compare_digest() raises TypeError on non-ASCII str
+    if METRICS_TOKEN is not None and \
+            not hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8'),
+                                    'Bearer {}'.format(METRICS_TOKEN).encode('utf-8')):
+        return make_response(jsonify(ok=False), 401)
+
+    return make_response(metrics.render(), 200, {'Content-Type': metrics.CONTENT_TYPE})
+
+
+def _is_admin():
+    user_or_session, identity = current_identity
+    return user_or_session == 'user' and identity in ADMIN_USER_IDS
+
+
+@jwt_required()
+def list_profiles():
+    if not _is_admin():
+        return make_response(jsonify(ok=False), 403)
+
+    return jsonify(ok=True,
+                   enabled=profiling.enabled(),
+                   mode=profiling.PROFILE_MODE,
+                   profiles=profiling.summaries())
+
+
+@jwt_required()
+def get_profile_dump(endpoint):
+    if not _is_admin():
+        return make_response(jsonify(ok=False), 403)
+
+    format = request.args.get('format', 'pstats')
+    if format not in ('pstats', 'collapsed'):
+        return make_response(jsonify(ok=False, error='Unknown format'), 400)
+    data = profiling.export(endpoint, format)
+    if data is None:
+        return make_response(jsonify(ok=False), 404)
+
+    if format == 'pstats':
+        return make_response(data, 200, {
+            'Content-Type': 'application/octet-stream',
+            'Content-Disposition': 'attachment; filename="{}.pstats"'.format(endpoint),
+        })
+    return make_response(data, 200, {'Content-Type': 'text/plain; charset=utf-8'})
+
+
+@jwt_required()
+def reset_profiles():
+    if not _is_admin():
+        return make_response(jsonify(ok=False), 403)
+
+    profiling.reset()
+    return jsonify(ok=True)
+
+
+@jwt_required()
+def list_slow_queries():
+    if not _is_admin():
+        return make_response(jsonify(ok=False), 403)
+
+    return jsonify(ok=True,
+                   threshold_ms=slowlog.SLOW_QUERY_THRESHOLD * 1000,
+                   queries=slowlog.recent())
+
+
+@jwt_required()
+def reset_slow_queries():
+    if not _is_admin():
+        return make_response(jsonify(ok=False), 403)
+
+    slowlog.reset()
+    return jsonify(ok=True)
+
+
+@query_budget(4)
 def login():
     access_code = request.json.get('access_code')
 
     try:
-        oauth2credential = client.step2_exchange(access_code)
+        oauth2credential = client.step2_exchange(access_code, http=outbound.oauth_http)
         user_id = oauth2credential.id_token['sub']
         user = db.session.query(User).filter(User.user_id==user_id).first()
 
         if user is None:
             db.session.add(User(user_id=user_id, provider='GOOGLE'))
-            db.session.add(Collection(owner_id=user_id, name='Default', term_ids=[]))
+            db.session.add(Collection(owner_id=user_id, name='Default'))
             db.session.commit()
 
         iat = datetime.utcnow()
@@ -141,8 +206,11 @@ def login():
                        token=token.decode())
     except (FlowExchangeError, ValueError) as e:
         return make_response(jsonify(ok=False), 400)
+    except outbound.Unavailable:
+        return make_response(jsonify(ok=False, error='Sign-in unavailable'), 503)
 
 
+@query_budget(2)
 @jwt_required()
 def get_profile():
     try:
@@ -187,12 +255,17 @@ def create_game_session():
                                          error='Recaptcha missing'),
                                  400)
 
-        if not is_human(recaptcha_token):
+        try:
+            human = is_human(recaptcha_token)
+        except outbound.Unavailable:
+            return make_response(jsonify(ok=False,
+                                         error='Recaptcha unavailable'),
+                                 503)
+        if not human:
             return make_response(jsonify(ok=False,
                                          error='Bad recaptcha'),
                                  400)
-        category = _get_random_category()
-        category_id = category.id
+        category_id = _get_random_category_id()
     else:
         category_id = request.json.get('category_id') if request.json is not None else None
         user_or_session, identity = _current_identity
@@ -230,14 +303,9 @@ def get_my_session():
     user_or_session, identity = current_identity
 
     if user_or_session == 'user':
-        game_session = db.session.query(Session)\
-            .filter(Session.user_id==identity) \
-            .order_by(-Session.created_at)\
-            .first()
+        game_session = reads.latest_session(identity)
     else:
-        game_session = db.session.query(Session) \
-            .filter(Session.id == identity) \
-            .first()
+        game_session = reads.session(identity)
 
     if game_session is None:
         return jsonify(ok=False)
@@ -246,12 +314,16 @@ def get_my_session():
                    session=game_session)\
 
 
-def _get_random_category():
+def _get_random_category_id():
+    generation = sharedcache.current()
+    if generation is not None and len(generation) > 0:
+        return generation.category_ids[randint(0, len(generation) - 1)]
+
     count = db.session.query(Category).count()
     return (db.session.query(Category)
             .offset(randint(0, count - 1))
             .first()
-           )
+           ).id
 
 
 @jwt_required()
@@ -285,20 +357,41 @@ def search_terms():
         return jsonify(ok=True,
                        terms=[])
 
-    terms = (db.session.query(Term)
-             .distinct()
-             .filter(Term.word.ilike('{}%'.format(query)))
-             .filter(Term.tags.like('SUB:NOM:SIN%'))
-             .all()
-             )
+    limit = request.args.get('limit', search.SEARCH_DEFAULT_LIMIT, type=int)
+    limit = max(1, min(limit, search.SEARCH_MAX_LIMIT))
+
+    if request.args.get('mode') == 'fuzzy':
+        matches = search.indexes().fuzzy.search(query, limit)
+        return jsonify(ok=True,
+                       terms=[dict(id=term_id,
+                                   word=word,
+                                   distance=distance)
+                              for term_id, word, distance in matches],
+                       after=None)
+
+    # `after` is "id,word" of the last term of the previous page; words differing only in case share a key
+    after = request.args.get('after')
+    if after:
+        try:
+            term_id, word = after.split(',', 1)
+            after = (word, int(term_id))
+        except ValueError:
+            return make_response(jsonify(ok=False), 400)
+    else:
+        after = None
+
+    terms, has_more = search.indexes().prefix.search(query, limit, after)
+
     return jsonify(ok=True,
-                   terms=[dict(id=item.id,
-                               word=item.word)
-                          for item in terms])
+                   terms=[dict(id=term_id,
+                               word=word)
+                          for term_id, word in terms],
+                   after='{},{}'.format(*terms[-1]) if has_more else None)
 
 
 def list_collections():
-    collections = db.session.query(Category).all()
+    generation = sharedcache.current()
+    collections = generation.categories() if generation is not None else reads.categories()
 
     return jsonify(ok=True,
                    collections=collections)
@@ -311,15 +404,12 @@ def list_my_collections():
         return make_response(jsonify(ok=False),
                              403)
 
-    collections = db.session\
-            .query(Collection)\
-            .filter(Collection.owner_id==identity)\
-            .all()
+    collections = reads.collections(identity)
 
     return jsonify(ok=True,
                    collections=[dict(
-                       id=item.id,
-                       name=item.name,
+                       id=item['id'],
+                       name=item['name'],
                        is_owned=True,
                    ) for item in collections])
 
@@ -358,24 +448,36 @@ def get_collection(collection_id):
         return make_response(jsonify(ok=False),
                              403)
 
-    collection = (db.session.query(Collection)
-                  .filter(Collection.owner_id == identity)
-                  .filter(Collection.id == collection_id)
-                  .one()
-                  )
+    collection = reads.collection(identity, collection_id)
     if collection is None:
         return make_response(jsonify(ok=False), 404)
 
-    terms = [] if collection.term_ids is None else (db.session.query(Term)
-                                                    .filter(Term.id.in_(collection.term_ids))
-                                                    .all())
+    # Optional keyset pagination: `after` is "position,term_id" of the last term of the previous page
+    limit = request.args.get('limit', type=int)
+    after = request.args.get('after')
+
+    query = (db.session.query(CollectionTerm.term_id, CollectionTerm.position)
+             .filter(CollectionTerm.collection_id == collection['id'])
+             .order_by(CollectionTerm.position, CollectionTerm.term_id))
+    if after:
+        try:
+            position, term_id = (int(value) for value in after.split(','))
+        except ValueError:
+            return make_response(jsonify(ok=False), 400)
+        query = query.filter(tuple_(CollectionTerm.position, CollectionTerm.term_id) > tuple_(position, term_id))
+    if limit is not None:
+        query = query.limit(max(1, limit))
+    rows = query.all()
+
+    result = dict(id=collection['id'],
+                  name=collection['name'],
+                  is_owned=True,
+                  terms=_get_terms([term_id for term_id, _ in rows]) if len(rows) > 0 else [])
+    if limit is not None:
+        result['after'] = '{},{}'.format(rows[-1][1], rows[-1][0]) if len(rows) > 0 else None
+
     return make_response(jsonify(ok=True,
-                                 collection=dict(
-                                     id=collection.id,
-                                     name=collection.name,
-                                     is_owned=True,
-                                     terms=terms,
-                                 )), 200)
+                                 collection=result), 200)
 
 
 @jwt_required()
@@ -417,26 +519,32 @@ def add_term_to_collection(collection_id):
         return make_response(jsonify(ok=False),
                              403)
 
+    body = request.json
+    term_id = body.get('term_id') if isinstance(body, dict) else None
+    if not valid_term_id(term_id):
+        return make_response(jsonify(ok=False), 400)
+
+    # The row lock serializes changes to the collection, keeping positions dense and unique
     collection = (db.session.query(Collection)
                   .filter(Collection.owner_id == identity)
                   .filter(Collection.id==collection_id)
+                  .with_for_update()
                   .first()
                   )
     if collection is None:
         return make_response(jsonify(ok=False), 404)
 
-    if 'term_id' not in request.json:
-        return make_response(jsonify(ok=False), 400)
-
-    term_id = request.json['term_id']
-    if collection.term_ids is None:
-        collection.term_ids = [term_id]
-        db.session.add(collection)
-        db.session.commit()
-    elif term_id not in collection.term_ids:
-        collection.term_ids = collection.term_ids + [term_id]
-        db.session.add(collection)
-        db.session.commit()
+    db.session.execute(text(
+        """
+        INSERT INTO `collection_term` (collection_id, term_id, position)
+        SELECT :collection_id, :term_id, COALESCE(MAX(position), -1) + 1
+        FROM `collection_term` WHERE collection_id = :collection_id
+        ON DUPLICATE KEY UPDATE position = `collection_term`.position
+        """
+        ),
+        dict(collection_id=collection.id,
+             term_id=term_id))
+    db.session.commit()
 
     return jsonify(ok=True,
                    collection=collection)
@@ -452,23 +560,38 @@ def remove_term_from_collection(collection_id, term_id):
     collection = (db.session.query(Collection)
                   .filter(Collection.owner_id == identity)
                   .filter(Collection.id==collection_id)
+                  .with_for_update()
                   .first()
                   )
     if collection is None:
         return make_response(jsonify(ok=False), 404)
 
-    if collection.term_ids is None:
-        return jsonify(ok=True,
-                       collection=collection)
-    elif term_id in collection.term_ids:
-        collection.term_ids = [_id for _id in collection.term_ids if _id != term_id]
-        db.session.add(collection)
-        db.session.commit()
+    position = (db.session.query(CollectionTerm.position)
+                .filter(CollectionTerm.collection_id == collection.id,
+                        CollectionTerm.term_id == term_id)
+                .scalar())
+    if position is not None:
+        (db.session.query(CollectionTerm)
+         .filter(CollectionTerm.collection_id == collection.id,
+                 CollectionTerm.term_id == term_id)
+         .delete(synchronize_session=False))
+        # Close the gap; in ascending order so the unique key holds after every row
+        db.session.execute(text(
+            """
+            UPDATE `collection_term` SET position = position - 1
+            WHERE collection_id = :collection_id AND position > :position
+            ORDER BY position
+            """
+            ),
+            dict(collection_id=collection.id,
+                 position=position))
+    db.session.commit()
 
     return jsonify(ok=True,
                    collection=collection)
 
 
+@query_budget(4)
 @jwt_required()
 def next_word():
     raw_cursor = request.args.get('cursor')
@@ -484,21 +607,33 @@ def next_word():
 
     if 'category_id' in cursor:
         category_id = cursor['category_id']
-
-        # TODO Refactor this magic from_statement SQL
-        term = _term_from_category(category_id, seed, offset)
-        next_term = _term_from_category(category_id, seed, offset + 1)
-        has_next = next_term is not None
+        deck = category_ids(category_id)
     elif 'collection_id' in cursor:
         collection_id = cursor['collection_id']
-        term = _term_from_collection(collection_id, seed, offset)
-        next_term = _term_from_collection(collection_id, seed, offset + 1)
-        has_next = next_term is not None
+        deck = CollectionDeck(collection_id)
+
+    count = request.args.get('count', type=int)
+    if count is None:
+        term = _term_from_deck(deck, seed, offset)
+        has_next = offset + 1 < len(deck)
+
+        return jsonify(ok=True,
+                       term=term,
+                       has_next=has_next,
+                       cursor=_create_cursor(offset + 1,
+                                             seed=seed,
+                                             category_id=category_id,
+                                             collection_id=collection_id)
+                       )
+
+    count = max(1, min(count, MAX_WORDS_PER_PAGE))
+    terms = _terms_from_deck(deck, seed, offset, count)
+    next_offset = max(offset, min(offset + count, len(deck)))
 
     return jsonify(ok=True,
-                   term=term,
-                   has_next=has_next,
-                   cursor=_create_cursor(offset + 1,
+                   terms=terms,
+                   has_next=next_offset < len(deck),
+                   cursor=_create_cursor(next_offset,
                                          seed=seed,
                                          category_id=category_id,
                                          collection_id=collection_id)
@@ -512,38 +647,7 @@ def get_session_stat(session_id):
         return make_response(jsonify(ok=False),
                              403)
 
-    rows = db.session.query(WeeklyTermStat).from_statement(text(
-        """
-        SELECT T.id, TS.week, TS.session_id, T.word, N.tags,
-              SUM(TS.corrects) AS corrects, SUM(TS.wrongs) AS wrongs, SUM(TS.skippeds) AS skippeds
-        FROM      `term_stat`  AS TS
-        LEFT JOIN `session`    AS S ON S.id = TS.session_id
-        LEFT JOIN `term`       AS T ON T.id = TS.term_id
-        LEFT JOIN `nomen`      AS N ON N.form = T.word
-        WHERE S.id = :session_id
-            AND SUBSTR(tags, 1, 11) = 'SUB:NOM:SIN'
-        GROUP BY T.id, TS.week, TS.session_id, T.word, N.tags
-        """
-        ))\
-        .params(session_id=session_id)
-
-    game_type = 'gender'
-
-    def count_corrects_wrongs(acc, item):
-        acc.update(corrects=int(acc['corrects'] + item.corrects),
-                   wrongs=int(acc['wrongs'] + item.wrongs)
-                   )
-        return acc
-
-    if game_type == 'gender':
-        report = dict(der=reduce(count_corrects_wrongs, [row for row in rows if row.tags == 'SUB:NOM:SIN:MAS'],
-                                 dict(corrects=0, wrongs=0)),
-                      die=reduce(count_corrects_wrongs, [row for row in rows if row.tags == 'SUB:NOM:SIN:FEM'],
-                                 dict(corrects=0, wrongs=0)),
-                      das=reduce(count_corrects_wrongs, [row for row in rows if row.tags == 'SUB:NOM:SIN:NEU'],
-                                 dict(corrects=0, wrongs=0)))
-    else:
-        report = {}
+    report = session_report(session_id)
 
     return jsonify(ok=True,
                    report=report)
@@ -565,59 +669,27 @@ def get_weekly_performance_stat():
     report = dict()
 
     if 'worst' in types:
-        worst_performers = (db.session.query(PerformanceStat)
-                            .filter(PerformanceStat.user_id == identity)
-                            .filter(PerformanceStat.correct_factor != 1)
-                            .filter(PerformanceStat.week >= week - WEEKS_LIMIT)
-                            .limit(100)
-                            .all()
-                            )
-        report['worst_performers'] = worst_performers
+        report['worst_performers'] = reads.worst_performers(identity, week - WEEKS_LIMIT)
 
     if 'weekly' in types:
-        weekly_performance = (db.session.query(PerformanceStat)
-                              .from_statement(text(
-            """
-            SELECT `week` as `term_id`, '' AS user_id, '' AS word, '' AS tags, `week`,
-                AVG(confidence_factor) AS confidence_factor,
-                AVG(correct_factor) AS correct_factor
-            FROM performance_stat
-            WHERE user_id = :user_id AND week >= :week
-            GROUP BY `week`
-            """
-                              ))
-                              .params(user_id=identity,
-                                      week=week-WEEKS_LIMIT)
-                              .all())
-        report['weekly_performance'] = [dict(week=item.week,
-                                             confidence_factor=float(item.confidence_factor),
-                                             correct_factor=float(item.correct_factor))
-                                       for item in weekly_performance]
+        report['weekly_performance'] = reads.weekly_performance(identity, week - WEEKS_LIMIT)
 
     if 'histogram' in types:
-        histogram = (db.engine.execute(text(
+        histogram = db.session.execute(text(
             """
-            SELECT AB.`seconds`, correct_count, wrong_count
-            FROM (SELECT DISTINCT `seconds`
-                FROM `term_stat` JOIN `session` AS S ON S.id = session_id
-                WHERE user_id = :user_id AND week >= :week) AS AB
-            LEFT JOIN (SELECT seconds_correct AS `seconds`, COUNT(*) AS correct_count
-                FROM `term_stat` JOIN `session` AS S ON S.id = session_id
-                WHERE seconds_correct IS NOT NULL AND user_id = :user_id AND week >= :week
-                GROUP BY seconds_correct) AS A ON AB.`seconds` = A.`seconds`
-            LEFT JOIN
-                (SELECT seconds, COUNT(*) AS wrong_count
-                FROM `term_stat` JOIN `session` AS S ON S.id = session_id
-                WHERE seconds_correct IS NULL AND user_id = :user_id AND week >= :week
-                GROUP BY seconds) AS B ON AB.`seconds` = B.`seconds`
-            ORDER BY AB.`seconds`;
+            SELECT bucket AS `seconds`,
+                SUM(correct_count) AS correct_count, SUM(wrong_count) AS wrong_count
+            FROM `answer_histogram`
+            WHERE user_id = :user_id AND week >= :week
+            GROUP BY bucket
+            ORDER BY bucket
             """
-                    ),
-        week=week - WEEKS_LIMIT,
-        user_id=identity))
+            ),
+            dict(week=week - WEEKS_LIMIT,
+                 user_id=identity))
         report['histogram'] = [dict(seconds=item['seconds'],
-                                    correct_count=item['correct_count'],
-                                    wrong_count=item['wrong_count'])
+                                    correct_count=int(item['correct_count']),
+                                    wrong_count=int(item['wrong_count']))
                                for item in histogram
                                ]
 
@@ -629,46 +701,46 @@ def get_weekly_performance_stat():
                    report=report)
 
 
+def _get_json_body():
+    """
+    JSON request body, optionally sent with `Content-Encoding: gzip`
+    """
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        data = decompressor.decompress(request.get_data(), MAX_BODY_SIZE)
+        if decompressor.unconsumed_tail:
+            raise ValueError('Body too large')
+        return json.loads(data)
+    return request.json
+
+
 @jwt_required()
 def create_stat():
+    """
+    Record one answer event, or an array of them in a single statement
+    """
     week = (datetime.utcnow() - EPOCH).days / 7
-    session_id = request.json.get('session_id')
-    term_id = request.json.get('term_id')
-    correct = request.json.get('correct', None)
-    skipped = request.json.get('skipped', None)
-    seconds = request.json.get('seconds', 1)
+    try:
+        body = _get_json_body()
+    except (zlib.error, ValueError):
+        return make_response(jsonify(ok=False), 400)
+
+    events = body if isinstance(body, list) else [body]
 
     # TODO Check if session belongs to identity
 
-    if term_id is None:
+    if not all(valid_event(event) for event in events):
         return make_response(jsonify(ok=False), 400)
 
-    exists = db.session.query(db.session.query(TermStat)\
-        .filter(TermStat.session_id == session_id,
-                TermStat.term_id == term_id)\
-        .exists())\
-        .scalar()
-
-    if exists:
-        db.session.query(TermStat) \
-            .filter(TermStat.session_id == session_id,
-                    TermStat.term_id == term_id) \
-            .update({
-                TermStat.corrects: TermStat.corrects + 1 if correct == True else TermStat.corrects,
-                TermStat.wrongs: TermStat.wrongs + 1 if correct == False else TermStat.wrongs,
-                TermStat.skippeds: TermStat.skippeds + 1 if skipped == True else TermStat.skippeds,
-                TermStat.seconds: TermStat.seconds + seconds,
-                TermStat.seconds_correct: TermStat.seconds_correct + seconds if correct == True else TermStat.seconds_correct,
-            })
+    if writebehind.buffer is not None:
+        try:
+            writebehind.buffer.append(events, week)
+        except writebehind.BufferFull:
+            return make_response(jsonify(ok=False, error='Busy'), 503)
     else:
-        db.session.add(TermStat(session_id=session_id,
-                                term_id=term_id,
-                                week=week,
-                                corrects=1 if correct == True else 0,
-                                wrongs=1 if correct == False else 0,
-                                skippeds=1 if skipped == True else 0,
-                                seconds=seconds,
-                                seconds_correct=seconds if correct == True else None))
-        db.session.commit()
+        upsert_term_stats(events, week)
 
+    if isinstance(body, list):
+        return jsonify(ok=True,
+                       count=len(events))
     return jsonify(ok=True)
@@ -0,0 +1,194 @@
+"""
+Per-endpoint request and SQL metrics
+
+Flask hooks time every request and SQLAlchemy cursor events time every
+statement, both recorded under the endpoint name registered in main.py, e.g.
+"get-next-word". Statements issued outside a request, by the write-behind
+flusher or the cache builders, are recorded under "background". State lives in
+a thread-local, so the hot path takes no locks.
+
+Responses can carry a Server-Timing header splitting the request into auth
+(JWT decoding and identity), db (SQL, with the statement count), orm (turning
+rows into objects), serialize (JSON encoding) and total. It is added to every
+response when SERVER_TIMING=1, or to requests whose X-Debug-Token header
+matches SERVER_TIMING_TOKEN.
+"""
+import os
+import sys
+import hmac
+from contextlib import contextmanager
+from threading import local
+from timeit import default_timer
+
+from flask import request
+from flask_sqlalchemy import BaseQuery
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import metrics
+
+SERVER_TIMING = os.getenv('SERVER_TIMING', '0') != '0'
+SERVER_TIMING_TOKEN = os.getenv('SERVER_TIMING_TOKEN', None)
+
+# Requests that match no route
+UNMATCHED = 'unmatched'
+BACKGROUND = 'background'
+PHASES = ('auth', 'orm', 'serialize')
+# Modules call_site() looks past, the ones hooking into SQLAlchemy add themselves
+INTERNAL_MODULES = {__name__}
+
+_current = local()
+
+
+class RequestStats:
+    __slots__ = ('endpoint', 'started', 'statements', 'sql_seconds', 'phases')
+
+    def __init__(self, endpoint, timed=False):
+        self.endpoint = endpoint
+        self.started = default_timer()
+        self.statements = 0
+        self.sql_seconds = 0.0
+        # Seconds by phase, only collected for requests answered with Server-Timing
+        self.phases = dict.fromkeys(PHASES, 0.0) if timed else None
+
+
+def current():
+    """
+    :return: RequestStats of the request this thread is handling, None outside requests
+    """
+    return getattr(_current, 'stats', None)
+
+
+def timed():
+    """
+    :return: RequestStats of this thread's request if it collects Server-Timing phases, else None
+    """
+    stats = getattr(_current, 'stats', None)
+    return stats if stats is not None and stats.phases is not None else None
+
+
+def call_site():
+    """
+    :return: "module:function:line" of the innermost caller in this package, None if there is none
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith('wordgameapi.') and module not in INTERNAL_MODULES:
+            return '{}:{}:{}'.format(module, frame.f_code.co_name, frame.f_lineno)
+        frame = frame.f_back
+    return None
+
+
+@contextmanager
+def phase(name):
+    """
+    Adds the time spent in the block to a Server-Timing phase of the current request
+    """
+    stats = timed()
+    if stats is None:
+        yield
+        return
+    started = default_timer()
+    try:
+        yield
+    finally:
+        stats.phases[name] += default_timer() - started
+
+
+class TimedQuery(BaseQuery):
+    """
+    Query whose row loading counts as the orm phase
+
+    The statement runs when the query is iterated; the time left once the SQL
+    time is taken out went to building objects. Rows are loaded eagerly, but
+    only for requests that collect Server-Timing phases.
+    """
+    def __iter__(self):
+        stats = timed()
+        if stats is None:
+            return super().__iter__()
+
+        sql_seconds = stats.sql_seconds
+        started = default_timer()
+        rows = list(super().__iter__())
+        stats.phases['orm'] += default_timer() - started - (stats.sql_seconds - sql_seconds)
+        return iter(rows)
+
+
+def _server_timing(stats, total):
+    entries = ['{};dur={:.2f}'.format(name, stats.phases[name] * 1000) for name in PHASES]
+    entries.insert(1, 'db;dur={:.2f};desc="{} {}"'.format(stats.sql_seconds * 1000, stats.statements,
+                                                         'query' if stats.statements == 1 else 'queries'))
+    entries.append('total;dur={:.2f}'.format(total * 1000))
+    return ', '.join(entries)
+
+
+def _wants_timing():
+    if SERVER_TIMING:
+        return True
+    if SERVER_TIMING_TOKEN is None:
+        return False
+    # Bytes on both sides: compare_digest() raises TypeError on non-ASCII str
+    return hmac.compare_digest(request.headers.get('X-Debug-Token', '').encode('utf-8'),
+                               SERVER_TIMING_TOKEN.encode('utf-8'))
+
+
+requests_total = metrics.Counter('http_requests_total', 'Requests by endpoint, method and status',
+                                 ('endpoint', 'method', 'status'))
+request_seconds = metrics.Histogram('http_request_duration_seconds', 'Request latency by endpoint',
+                                    ('endpoint',))
+statements_total = metrics.Counter('db_statements_total', 'SQL statements executed by endpoint',
+                                   ('endpoint',))
+statement_seconds = metrics.Counter('db_statement_seconds_total', 'Time spent executing SQL statements by endpoint',
+                                    ('endpoint',))
+
+
+def _before_request():
+    _current.stats = RequestStats(request.endpoint or UNMATCHED, _wants_timing())
+
+
+def _after_request(response):
+    stats = current()
+    if stats is not None:
+        elapsed = default_timer() - stats.started
+        labels = (stats.endpoint,)
+        requests_total.inc((stats.endpoint, request.method, response.status_code))
+        request_seconds.observe(labels, elapsed)
+        if stats.statements:
+            statements_total.inc(labels, stats.statements)
+            statement_seconds.inc(labels, stats.sql_seconds)
+        if stats.phases is not None:
+            response.headers['Server-Timing'] = _server_timing(stats, elapsed)
+            # Lets pages on other origins read the timings
+            response.headers['Timing-Allow-Origin'] = '*'
+    return response
+
+
+def _teardown_request(exception):
+    _current.stats = None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # A thread runs one statement at a time
+    _current.statement_started = default_timer()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = default_timer() - _current.statement_started
+    stats = current()
+    if stats is None:
+        statements_total.inc((BACKGROUND,))
+        statement_seconds.inc((BACKGROUND,), elapsed)
+    else:
+        stats.statements += 1
+        stats.sql_seconds += elapsed
+
+
+def init_app(app):
+    # Registered ahead of the other hooks so their time is counted too
+    app.before_request_funcs.setdefault(None, []).insert(0, _before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
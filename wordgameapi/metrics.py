@@ -0,0 +1,328 @@
+"""
+Process-local metrics rendered in the Prometheus text format
+
+Counters and histograms keep one cell dict per thread, so recording is a
+dict update without any lock; a scrape copies and sums the cells of every
+thread. Gauges are read from callbacks at scrape time.
+
+Without METRICS_DIR every process reports its own values, labelled with its
+pid, so a pre-fork server (WSGI_WORKERS > 1) needs one scrape target per
+worker. With METRICS_DIR, a directory shared by the workers, each worker
+dumps its values there every METRICS_DUMP_INTERVAL seconds and whenever it
+is scraped, and a scrape reports the sum over all workers without the pid
+label. Counters of workers that exited are folded into an archive, so
+totals never go down when workers are replaced; their gauges are dropped.
+"""
+import os
+import json
+import fcntl
+import logging
+from bisect import bisect_left
+from threading import Lock, Thread, local
+from time import sleep
+
+METRICS_DIR = os.getenv('METRICS_DIR', None)
+METRICS_DUMP_INTERVAL = float(os.getenv('METRICS_DUMP_INTERVAL', 5))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Seconds, for latency histograms
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+ARCHIVE = 'archive.json'
+
+logger = logging.getLogger(__name__)
+
+_registry = []
+_registry_lock = Lock()
+_dumper_pid = None
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if METRICS_DIR is None:
+        pairs.append(('pid', os.getpid()))
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_ = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = local()
+        self._threads = []
+        self._lock = Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _cells(self):
+        cells = getattr(self._local, 'cells', None)
+        if cells is None:
+            cells = self._local.cells = dict()
+            with self._lock:
+                self._threads.append(cells)
+        return cells
+
+    def _snapshot(self):
+        with self._lock:
+            threads = list(self._threads)
+        # dict.copy() runs without releasing the GIL, so it never sees a half-done update
+        return [cells.copy() for cells in threads]
+
+    def render(self, values=None):
+        """
+        :param values: Label values to value, this process's own by default
+        """
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.type_)]
+        lines.extend(self._samples(self.collect() if values is None else values))
+        return lines
+
+    @staticmethod
+    def merge(total, value):
+        return total + value
+
+
+class Counter(_Metric):
+    type_ = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        cells = self._cells()
+        cells[labels] = cells.get(labels, 0) + amount
+
+    def values(self):
+        """
+        :return: Mapping of label values to the total of all threads
+        """
+        totals = dict()
+        for cells in self._snapshot():
+            for labels, value in cells.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    collect = values
+
+    def _samples(self, values):
+        return ['{}{} {}'.format(self.name, _labels(self.labelnames, labels), _number(value))
+                for labels, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    type_ = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels=(), value=0):
+        cells = self._cells()
+        cell = cells.get(labels)
+        if cell is None:
+            # Per bucket counts (the last one is +Inf), then sum and count
+            cell = cells[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def values(self):
+        totals = dict()
+        for cells in self._snapshot():
+            for labels, cell in cells.items():
+                total = totals.setdefault(labels, [0] * len(cell))
+                for i, value in enumerate(list(cell)):
+                    total[i] += value
+        return totals
+
+    collect = values
+
+    @staticmethod
+    def merge(total, cell):
+        return [a + b for a, b in zip(total, cell)]
+
+    def _samples(self, values):
+        samples = []
+        for labels, cell in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), cell):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                samples.append('{}_bucket{} {}'.format(self.name, _labels(self.labelnames, labels, [('le', le)]),
+                                                       cumulative))
+            samples.append('{}_sum{} {}'.format(self.name, _labels(self.labelnames, labels), _number(cell[-2])))
+            samples.append('{}_count{} {}'.format(self.name, _labels(self.labelnames, labels), cell[-1]))
+        return samples
+
+
+class Gauge(_Metric):
+    type_ = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        """
+        :param callback: Returns a mapping of label values to the current value
+        """
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def collect(self):
+        return self.callback()
+
+    def _samples(self, values):
+        return ['{}{} {}'.format(self.name, _labels(self.labelnames, labels), _number(value))
+                for labels, value in sorted(values.items())]
+
+
+class CounterCallback(Gauge):
+    """
+    Counter whose totals are kept elsewhere and read at scrape time
+    """
+    type_ = 'counter'
+
+
+def _metrics():
+    with _registry_lock:
+        return list(_registry)
+
+
+def _path(name):
+    return os.path.join(METRICS_DIR, name)
+
+
+def _read(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return dict()
+
+
+def _write(path, data):
+    temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary_path, 'w') as file:
+        json.dump(data, file)
+    os.rename(temporary_path, path)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _add(totals, metric, samples):
+    """
+    Add dumped [label values, value] samples of `metric` into totals
+    """
+    values = totals.setdefault(metric.name, dict())
+    for labels, value in samples:
+        labels = tuple(labels)
+        values[labels] = metric.merge(values[labels], value) if labels in values else value
+
+
+def dump():
+    """
+    Write the values of this process to METRICS_DIR
+    """
+    _write(_path('{}.json'.format(os.getpid())),
+           {metric.name: [[list(labels), value] for labels, value in metric.collect().items()]
+            for metric in _metrics()})
+
+
+def _collect_dumps():
+    """
+    :return: Metric name to summed values of every dump; dumps of exited processes are folded into the archive
+    """
+    metrics = {metric.name: metric for metric in _metrics()}
+    with open(_path('.lock'), 'a') as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        archive = dict()
+        totals = dict()
+        for name, samples in _read(_path(ARCHIVE)).items():
+            if name in metrics:
+                _add(archive, metrics[name], samples)
+                _add(totals, metrics[name], samples)
+
+        exited = []
+        for name in os.listdir(METRICS_DIR):
+            pid, _, extension = name.partition('.')
+            if extension != 'json' or not pid.isdigit():
+                continue
+            alive = _alive(int(pid))
+            for metric_name, samples in _read(_path(name)).items():
+                metric = metrics.get(metric_name)
+                if metric is None:
+                    continue
+                if not alive and metric.type_ != 'gauge':
+                    _add(archive, metric, samples)
+                if alive or metric.type_ != 'gauge':
+                    _add(totals, metric, samples)
+            if not alive:
+                exited.append(name)
+
+        if exited:
+            _write(_path(ARCHIVE), {name: [[list(labels), value] for labels, value in values.items()]
+                                    for name, values in archive.items()})
+            for name in exited:
+                os.unlink(_path(name))
+    return totals
+
+
+def render():
+    """
+    :return: Every metric of this process, or of every process sharing METRICS_DIR, in the Prometheus text format
+    """
+    lines = []
+    if METRICS_DIR is None:
+        for metric in _metrics():
+            lines.extend(metric.render())
+    else:
+        dump()
+        totals = _collect_dumps()
+        for metric in _metrics():
+            lines.extend(metric.render(totals.get(metric.name, dict())))
+    return '\n'.join(lines) + '\n'
+
+
+def _run_dumper():
+    pid = os.getpid()
+    while _dumper_pid == pid:
+        sleep(METRICS_DUMP_INTERVAL)
+        try:
+            dump()
+        except OSError:
+            logger.exception('Dumping metrics to %s failed', METRICS_DIR)
+
+
+def start():
+    """
+    Start dumping the values of this process to METRICS_DIR; a no-op without it or once running
+    """
+    global _dumper_pid
+    if METRICS_DIR is None or _dumper_pid == os.getpid():
+        return
+    with _registry_lock:
+        if _dumper_pid == os.getpid():
+            return
+        # Threads do not survive fork(), every worker runs its own dumper
+        _dumper_pid = os.getpid()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    Thread(target=_run_dumper, name='metrics-dump', daemon=True).start()
+
+
+def init_app(app):
+    app.before_first_request(start)
@@ -1,10 +1,23 @@
 from dataclasses import dataclass
 
 from sqlalchemy import ForeignKey
-from sqlalchemy.sql import func
+from sqlalchemy.dialects.mysql import TINYINT
+from sqlalchemy.sql import func, case
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
+from .instrumentation import TimedQuery
+
+db = SQLAlchemy(query_class=TimedQuery)
+
+GENDER_MASCULINE = 1
+GENDER_FEMININE = 2
+GENDER_NEUTER = 3
+GENDER_TAGS = {
+    GENDER_MASCULINE: 'SUB:NOM:SIN:MAS',
+    GENDER_FEMININE: 'SUB:NOM:SIN:FEM',
+    GENDER_NEUTER: 'SUB:NOM:SIN:NEU',
+}
+NOUN_TAGS = 'SUB:NOM:SIN'
 
 
 @dataclass
@@ -58,28 +71,74 @@ class Collection(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), nullable=False)
     owner_id = db.Column(db.String(25), nullable=False)
-    term_ids = db.Column(db.JSON)
+
+
+class CollectionTerm(db.Model):
+    """
+    Membership of a term in a user collection
+
+    Positions of a collection are dense, 0 to count - 1, so a deck index is a position.
+    """
+    __tablename__ = 'collection_term'
+    __table_args__ = (
+        db.Index('ux_collection_term_collection_id_position', 'collection_id', 'position', unique=True),
+    )
+
+    collection_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    term_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    position = db.Column(db.Integer, nullable=False)
 
 
 @dataclass
 class Term(db.Model):
     """
-    Dictionary entries
+    Dictionary entries: nouns in nominative singular
 
-    CREATE OR REPLACE VIEW term_view AS
-        SELECT DISTINCT `term`.id, word, tags
-        FROM `term` JOIN `nomen` ON word = form
-        WHERE SUBSTR(tags, 1, 11) = 'SUB:NOM:SIN'
+    Materialized from `term` and `nomen` by `python manage.py refresh_dictionary`,
+    see wordgameapi.dictionary. `tags` is derived from the gender code.
     """
-    __tablename__ = 'term_view'
+    __tablename__ = 'noun'
 
     id: int
     word: str
     tags: str
 
-    id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
     word = db.Column(db.String(80), nullable=False)
-    tags = db.Column(db.String(80), nullable=False)
+    gender = db.Column(TINYINT, nullable=True, index=True)
+    normalized_word = db.Column(db.String(80), nullable=False, index=True)
+    tags = db.column_property(case(GENDER_TAGS, value=gender, else_=NOUN_TAGS))
+
+
+class CategoryNoun(db.Model):
+    """
+    Membership of a noun in a category, materialized along with `noun`
+    """
+    __tablename__ = 'category_noun'
+
+    category_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    noun_id = db.Column(db.Integer, primary_key=True, autoincrement=False, index=True)
+
+
+class DictionaryVersion(db.Model):
+    """
+    Single row, bumped by every dictionary refresh
+    """
+    __tablename__ = 'dictionary_version'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    version = db.Column(db.Integer, nullable=False)
+    refreshed_at = db.Column(db.DateTime, nullable=False)
+
+
+class TermFrequency(db.Model):
+    """
+    Answers recorded per term, rebuilt by every dictionary refresh
+    """
+    __tablename__ = 'term_frequency'
+
+    term_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    answers = db.Column(db.Integer, nullable=False)
 
 
 class TermStat(db.Model):
@@ -87,6 +146,10 @@ class TermStat(db.Model):
     Term Stat per user
     """
     __tablename__ = 'term_stat'
+    __table_args__ = (
+        db.Index('ix_term_stat_session_id_term_id', 'session_id', 'term_id', unique=True),
+        db.Index('ix_term_stat_session_id_gender', 'session_id', 'gender'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     week = db.Column(db.Integer, nullable=False, comment='Numerical presentation of week since epoch')
@@ -97,6 +160,49 @@ class TermStat(db.Model):
     skippeds = db.Column(db.Integer, nullable=False, default=0)
     seconds = db.Column(db.Integer, nullable=False, default=0, comment='Seconds taken to respond to this term')
     seconds_correct = db.Column(db.Integer, nullable=True, comment='Seconds taken to correctly answer this term')
+    gender = db.Column(TINYINT, nullable=True, comment='Gender code of the term, see GENDER_TAGS')
+
+
+class TermPerformance(db.Model):
+    """
+    Running sums of term_stat per user, term and week
+
+    `week` is the week of the term_stat row, i.e. of the first answer to the
+    term in its session. Maintained in the same transaction as stat ingestion;
+    rebuilt with `python manage.py backfill_performance`.
+    """
+    __tablename__ = 'term_performance'
+    __table_args__ = (
+        db.Index('ix_term_performance_user_id_week', 'user_id', 'week'),
+    )
+
+    user_id = db.Column(db.String(25), primary_key=True)
+    term_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    week = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    corrects = db.Column(db.Integer, nullable=False, default=0)
+    wrongs = db.Column(db.Integer, nullable=False, default=0)
+    seconds = db.Column(db.Integer, nullable=False, default=0)
+    seconds_correct = db.Column(db.Integer, nullable=True)
+
+
+class AnswerHistogram(db.Model):
+    """
+    Answers per user, week and response time bucket
+
+    Every answer is counted once, in the bucket of its own response time;
+    `bucket` is the lower bound in seconds of the bucket, see HISTOGRAM_BUCKETS.
+    `week` is the week of the answer's term_stat row, as in term_performance.
+    Answers folded into term_stat before the histogram existed are only known
+    by their sums, so `python manage.py backfill_histogram` files them under
+    the mean response time of their row.
+    """
+    __tablename__ = 'answer_histogram'
+
+    user_id = db.Column(db.String(25), primary_key=True)
+    week = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    bucket = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    correct_count = db.Column(db.Integer, nullable=False, default=0)
+    wrong_count = db.Column(db.Integer, nullable=False, default=0)
 
 
 class WeeklyTermStat(db.Model):
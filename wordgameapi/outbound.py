@@ -0,0 +1,243 @@
+"""
+Outbound calls to Google: pooled, time-bounded, retried and guarded by circuit breakers
+
+Requests go through one keep-alive `requests.Session` per process with strict
+connect and read timeouts. Only failures where Google cannot have processed
+the request (connect timeouts, refused connections, 429 and 503) are retried,
+with jittered exponential backoff: reCAPTCHA tokens and OAuth codes are
+single-use, so a request that may have been received (read timeouts, resets
+after sending, 502 and 504 from a proxy) is not sent again. Each provider has a
+circuit breaker that fails fast with Unavailable once it keeps failing, and
+verified reCAPTCHA tokens are cached for a short while so a client retrying a
+session start is not verified twice.
+"""
+import os
+from collections import OrderedDict
+from random import uniform
+from threading import Lock
+from time import sleep
+from timeit import default_timer
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+RECAPTCHA_SECRET = os.getenv('RECAPTCHA_SECRET', None)
+RECAPTCHA_VERIFY_URL = os.getenv('RECAPTCHA_VERIFY_URL', 'https://www.google.com/recaptcha/api/siteverify')
+OUTBOUND_CONNECT_TIMEOUT = float(os.getenv('OUTBOUND_CONNECT_TIMEOUT', 2))
+OUTBOUND_READ_TIMEOUT = float(os.getenv('OUTBOUND_READ_TIMEOUT', 5))
+OUTBOUND_RETRIES = int(os.getenv('OUTBOUND_RETRIES', 2))
+# Upper bound of the first retry delay in seconds, doubled on every retry
+OUTBOUND_BACKOFF = float(os.getenv('OUTBOUND_BACKOFF', 0.1))
+# Keep-alive connections per host
+OUTBOUND_POOL_SIZE = int(os.getenv('OUTBOUND_POOL_SIZE', 20))
+# Consecutive failures that open a circuit, and seconds before it lets a trial request through
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', 30))
+# reCAPTCHA tokens expire after two minutes
+RECAPTCHA_CACHE_TTL = float(os.getenv('RECAPTCHA_CACHE_TTL', 120))
+RECAPTCHA_CACHE_SIZE = int(os.getenv('RECAPTCHA_CACHE_SIZE', 10000))
+
+# Statuses telling the request was turned away rather than processed
+RETRY_STATUSES = {429, 503}
+
+
+class Unavailable(Exception):
+    """
+    The provider failed, timed out or its circuit is open
+    """
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if default_timer() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        """
+        :return: Whether a request may be sent; half-open circuits let one trial through
+        """
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = default_timer()
+            self._trial = False
+
+
+class TTLCache:
+    """
+    Size-bounded mapping whose entries expire `ttl` seconds after they were set
+    """
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < default_timer():
+                del self._items[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (value, default_timer() + self.ttl)
+            self._items.move_to_end(key)
+            # Entries share one ttl, so the oldest are the first to expire
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+recaptcha_breaker = CircuitBreaker('recaptcha', CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+oauth_breaker = CircuitBreaker('oauth', CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+verified_tokens = TTLCache(RECAPTCHA_CACHE_TTL, RECAPTCHA_CACHE_SIZE)
+
+_lock = Lock()
+_session = None
+_session_pid = None
+
+
+def session():
+    """
+    :return: Pooled HTTP session of this process; pooled sockets must not be shared across fork()
+    """
+    global _session, _session_pid
+    if _session_pid != os.getpid():
+        with _lock:
+            if _session_pid != os.getpid():
+                _session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=OUTBOUND_POOL_SIZE, max_retries=0)
+                _session.mount('https://', adapter)
+                _session.mount('http://', adapter)
+                _session_pid = os.getpid()
+    return _session
+
+
+def backoff(attempt):
+    """
+    :return: Seconds to wait before retry number `attempt`, jittered and doubling with every retry
+    """
+    return uniform(0, OUTBOUND_BACKOFF * 2 ** (attempt - 1))
+
+
+def _not_sent(error):
+    """
+    :return: Whether a ConnectionError happened before the request went out: connect timeout or refused connection
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    # requests wraps urllib3's MaxRetryError, whose reason is the underlying failure
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def request(breaker, method, url, **kwargs):
+    """
+    :return: Response with a status below 500
+    :raise Unavailable: On timeouts, connection errors and server errors left after retries
+    """
+    if not breaker.allow():
+        raise Unavailable('{} circuit is open'.format(breaker.name))
+
+    for attempt in range(OUTBOUND_RETRIES + 1):
+        if attempt > 0:
+            sleep(backoff(attempt))
+        try:
+            response = session().request(method, url,
+                                         timeout=(OUTBOUND_CONNECT_TIMEOUT, OUTBOUND_READ_TIMEOUT),
+                                         **kwargs)
+        except requests.ConnectionError as e:
+            if not _not_sent(e):
+                breaker.failure()
+                raise Unavailable('{}: {}'.format(breaker.name, e)) from e
+            error = e
+            continue
+        except requests.RequestException as e:
+            breaker.failure()
+            raise Unavailable('{}: {}'.format(breaker.name, e)) from e
+
+        if response.status_code in RETRY_STATUSES:
+            error = 'HTTP {}'.format(response.status_code)
+            continue
+        if response.status_code >= 500:
+            breaker.failure()
+            raise Unavailable('{}: HTTP {}'.format(breaker.name, response.status_code))
+        breaker.success()
+        return response
+
+    breaker.failure()
+    raise Unavailable('{}: {}'.format(breaker.name, error))
+
+
+def verify_recaptcha(token):
+    """
+    :return: Whether Google considers the reCAPTCHA response token human
+    """
+    result = verified_tokens.get(token)
+    if result is None:
+        response = request(recaptcha_breaker, 'POST', RECAPTCHA_VERIFY_URL,
+                           data={'response': token, 'secret': RECAPTCHA_SECRET})
+        result = bool(response.json().get('success'))
+        verified_tokens.set(token, result)
+    return result
+
+
+class _HttpResponse(dict):
+    """
+    The parts of httplib2.Response oauth2client reads
+    """
+    def __init__(self, response):
+        super().__init__((key.lower(), value) for key, value in response.headers.items())
+        self.status = response.status_code
+        self['status'] = str(response.status_code)
+
+
+class OAuthHttp:
+    """
+    httplib2-compatible transport for oauth2client, e.g. `client.step2_exchange(code, http=oauth_http)`
+    """
+    def request(self, uri, method='GET', body=None, headers=None, redirections=None, connection_type=None):
+        response = request(oauth_breaker, method, uri, data=body, headers=headers, allow_redirects=False)
+        return _HttpResponse(response), response.content
+
+
+oauth_http = OAuthHttp()
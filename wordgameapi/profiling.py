@@ -0,0 +1,260 @@
+"""
+Sampling profiler for requests
+
+A fraction of requests (PROFILE_SAMPLE_RATE), or every request to one endpoint
+(PROFILE_ENDPOINT, e.g. "get-next-word"), is profiled, and the results are
+aggregated per endpoint. With PROFILE_MODE=cprofile the requests run under
+cProfile and are downloadable as pstats; with PROFILE_MODE=stack a thread
+samples their stacks every PROFILE_INTERVAL seconds and they are downloadable
+as collapsed stacks for flamegraph.pl or speedscope.
+
+Overhead is capped by a budget: profiled requests take at most
+PROFILE_MAX_SHARE of wall time, and cProfile runs on one request at a time.
+Memory is capped at PROFILE_MAX_ENTRIES functions or stacks per endpoint;
+profiles that would add more are dropped.
+"""
+import os
+import sys
+import marshal
+import logging
+import cProfile
+import pstats
+from collections import Counter
+from random import random
+from threading import Lock, Thread, get_ident, local
+from time import sleep
+from timeit import default_timer
+
+from flask import request
+
+from .instrumentation import UNMATCHED
+
+MODE_CPROFILE = 'cprofile'
+MODE_STACK = 'stack'
+
+PROFILE_MODE = os.getenv('PROFILE_MODE', MODE_CPROFILE)
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_ENDPOINT = os.getenv('PROFILE_ENDPOINT', None)
+# Share of wall time profiled requests may take, and the most they may take in one burst in seconds
+PROFILE_MAX_SHARE = float(os.getenv('PROFILE_MAX_SHARE', 0.05))
+PROFILE_MAX_BURST = float(os.getenv('PROFILE_MAX_BURST', 5))
+PROFILE_MAX_ENTRIES = int(os.getenv('PROFILE_MAX_ENTRIES', 20000))
+# Seconds between stack samples
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))
+PROFILE_MAX_DEPTH = 128
+
+logger = logging.getLogger(__name__)
+
+
+class Budget:
+    """
+    Token bucket of profiling time, refilled at `share` seconds per second up to `burst`
+    """
+    def __init__(self, share, burst):
+        self.share = share
+        self.burst = burst
+        self.available = burst
+        self.updated = default_timer()
+        self._lock = Lock()
+
+    def allow(self):
+        with self._lock:
+            now = default_timer()
+            self.available = min(self.burst, self.available + (now - self.updated) * self.share)
+            self.updated = now
+            return self.available > 0
+
+    def spend(self, seconds):
+        with self._lock:
+            self.available -= seconds
+
+
+class EndpointProfile:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.requests = 0
+        self.dropped = 0
+        self.stats = None
+        self.stacks = Counter()
+        self.samples = 0
+
+    @property
+    def entries(self):
+        return len(self.stacks) if self.stats is None else len(self.stats.stats)
+
+    def add_profile(self, profile):
+        if self.entries >= PROFILE_MAX_ENTRIES:
+            self.dropped += 1
+            return
+        if self.stats is None:
+            self.stats = pstats.Stats(profile)
+        else:
+            self.stats.add(profile)
+        self.requests += 1
+
+    def add_stack(self, stack):
+        if stack not in self.stacks and len(self.stacks) >= PROFILE_MAX_ENTRIES:
+            self.dropped += 1
+            return
+        self.stacks[stack] += 1
+        self.samples += 1
+
+    def pstats(self):
+        """
+        :return: Bytes in the format of pstats.Stats.dump_stats(), None without cProfile data
+        """
+        return None if self.stats is None else marshal.dumps(self.stats.stats)
+
+    def collapsed(self):
+        """
+        :return: One "frame;frame;frame count" line per stack, None without samples
+        """
+        if not self.stacks:
+            return None
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in self.stacks.most_common())
+
+    def summary(self):
+        return dict(endpoint=self.endpoint,
+                    requests=self.requests,
+                    samples=self.samples,
+                    dropped=self.dropped,
+                    entries=self.entries)
+
+
+budget = Budget(PROFILE_MAX_SHARE, PROFILE_MAX_BURST)
+profiles = dict()
+
+_lock = Lock()
+# Held by the request running under cProfile
+_cprofile_lock = Lock()
+_current = local()
+# Thread ID to EndpointProfile of the requests whose stacks are sampled
+_sampled = dict()
+_sampler_pid = None
+
+
+def enabled():
+    return PROFILE_SAMPLE_RATE > 0 or PROFILE_ENDPOINT is not None
+
+
+def _profile_of(endpoint):
+    with _lock:
+        profile = profiles.get(endpoint)
+        if profile is None:
+            profile = profiles[endpoint] = EndpointProfile(endpoint)
+        return profile
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None and len(names) < PROFILE_MAX_DEPTH:
+        names.append('{}:{}'.format(frame.f_globals.get('__name__', '?'), frame.f_code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def _sample_forever():
+    me = get_ident()
+    while True:
+        sleep(PROFILE_INTERVAL)
+        with _lock:
+            sampled = list(_sampled.items())
+        if not sampled:
+            continue
+        frames = sys._current_frames()
+        with _lock:
+            for thread_id, profile in sampled:
+                frame = frames.get(thread_id)
+                if frame is not None and thread_id != me:
+                    profile.add_stack(_collapse(frame))
+
+
+def _start_sampler():
+    global _sampler_pid
+    if _sampler_pid == os.getpid():
+        return
+    with _lock:
+        if _sampler_pid != os.getpid():
+            Thread(target=_sample_forever, name='stack-sampler', daemon=True).start()
+            _sampler_pid = os.getpid()
+
+
+def _before_request():
+    endpoint = request.endpoint or UNMATCHED
+    if endpoint != PROFILE_ENDPOINT and random() >= PROFILE_SAMPLE_RATE:
+        return
+    if not budget.allow():
+        return
+
+    profile = _profile_of(endpoint)
+    if PROFILE_MODE == MODE_STACK:
+        _start_sampler()
+        with _lock:
+            _sampled[get_ident()] = profile
+        _current.profiler = None
+    else:
+        if not _cprofile_lock.acquire(blocking=False):
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active, e.g. a debugger
+            _cprofile_lock.release()
+            return
+        _current.profiler = profiler
+    _current.profile = profile
+    _current.started = default_timer()
+
+
+def _teardown_request(exception):
+    profile = getattr(_current, 'profile', None)
+    if profile is None:
+        return
+    _current.profile = None
+
+    profiler = _current.profiler
+    if profiler is None:
+        with _lock:
+            _sampled.pop(get_ident(), None)
+            profile.requests += 1
+    else:
+        profiler.disable()
+        try:
+            with _lock:
+                profile.add_profile(profiler)
+        except Exception:
+            logger.exception('Could not aggregate the profile of %s', profile.endpoint)
+        finally:
+            _cprofile_lock.release()
+    budget.spend(default_timer() - _current.started)
+
+
+def summaries():
+    with _lock:
+        return [profile.summary() for _, profile in sorted(profiles.items())]
+
+
+def export(endpoint, format):
+    """
+    :param format: "pstats" or "collapsed"
+    :return: Profile data of the endpoint, None if there is none in that format
+    """
+    with _lock:
+        profile = profiles.get(endpoint)
+        if profile is None:
+            return None
+        return profile.pstats() if format == 'pstats' else profile.collapsed()
+
+
+def reset():
+    with _lock:
+        profiles.clear()
+
+
+def init_app(app):
+    if not enabled():
+        return
+
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
@@ -0,0 +1,217 @@
+"""
+Query budgets and N+1 detection
+
+Handlers declare the most SQL statements a request may issue:
+
+    @query_budget(2)
+    @jwt_required()
+    def get_profile():
+
+Requests over budget raise QueryBudgetExceeded when the app is testing and
+are logged otherwise; QUERY_BUDGET_MODE=raise|warn|off overrides that. Every
+request is also checked for structurally identical statements (same SQL once
+literals are normalized away) issued QUERY_REPEAT_THRESHOLD times or more, the
+usual sign of an N+1 loop, which are logged with the code they came from.
+
+Tests can bound any block, e.g. a test client call:
+
+    with max_queries(4):
+        client.get('/api/words', query_string=dict(cursor=cursor))
+"""
+import os
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from threading import local
+
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import metrics
+from .instrumentation import INTERNAL_MODULES, UNMATCHED, call_site
+from .slowlog import normalize
+
+MODE_RAISE = 'raise'
+MODE_WARN = 'warn'
+MODE_OFF = 'off'
+
+# Defaults to raise when app.testing is set, warn otherwise
+QUERY_BUDGET_MODE = os.getenv('QUERY_BUDGET_MODE', None)
+QUERY_REPEAT_THRESHOLD = int(os.getenv('QUERY_REPEAT_THRESHOLD', 3))
+NORMALIZED_CACHE_SIZE = 2000
+
+INTERNAL_MODULES.add(__name__)
+
+logger = logging.getLogger(__name__)
+
+budget_exceeded = metrics.Counter('query_budget_exceeded_total', 'Requests over their query budget by endpoint',
+                                  ('endpoint',))
+repeated_statements = metrics.Counter('db_repeated_statements_total',
+                                      'Requests repeating a statement QUERY_REPEAT_THRESHOLD times by endpoint',
+                                      ('endpoint',))
+
+_current = local()
+# Statement as sent to the driver to its normalized form; ORM statements repeat verbatim
+_normalized = dict()
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class Recorder:
+    """
+    Statements issued by one thread while it is active, grouped by normalized SQL
+
+    Walking the stack for the call site is the costly part, so it is skipped
+    for the first occurrence of a statement: only repeated statements are
+    reported with the code they came from.
+    """
+    def __init__(self):
+        self.count = 0
+        # Normalized statement to its count
+        self.statements = Counter()
+        # Normalized statement to call site counts, from the second occurrence on
+        self.sites = dict()
+
+    def record(self, statement):
+        normalized = _normalized.get(statement)
+        if normalized is None:
+            if len(_normalized) >= NORMALIZED_CACHE_SIZE:
+                _normalized.clear()
+            normalized = _normalized[statement] = normalize(statement)
+        self.count += 1
+        self.statements[normalized] += 1
+        if self.statements[normalized] > 1:
+            sites = self.sites.get(normalized)
+            if sites is None:
+                sites = self.sites[normalized] = Counter()
+            sites[call_site()] += 1
+
+    def repeated(self, threshold=QUERY_REPEAT_THRESHOLD):
+        """
+        :return: (normalized statement, count, call site counts of the repeats) of the statements
+                 issued `threshold` times or more
+        """
+        return [(statement, count, self.sites[statement]) for statement, count in self.statements.items()
+                if count >= threshold]
+
+    def report(self):
+        lines = []
+        for statement, count in self.statements.most_common():
+            lines.append('{:>4} x {}'.format(count, statement))
+            lines.extend('         from {} ({}x after the first)'.format(site, site_count)
+                         for site, site_count in self.sites.get(statement, Counter()).most_common())
+        return '\n'.join(lines)
+
+
+def _recorders():
+    recorders = getattr(_current, 'recorders', None)
+    if recorders is None:
+        recorders = _current.recorders = []
+    return recorders
+
+
+@contextmanager
+def recording():
+    """
+    :return: Recorder of the statements this thread issues within the block
+    """
+    recorder = Recorder()
+    recorders = _recorders()
+    recorders.append(recorder)
+    try:
+        yield recorder
+    finally:
+        recorders.remove(recorder)
+
+
+@contextmanager
+def max_queries(limit):
+    """
+    :raise QueryBudgetExceeded: If the block issues more than `limit` statements
+    """
+    with recording() as recorder:
+        yield recorder
+    if recorder.count > limit:
+        raise QueryBudgetExceeded('{} queries, {} allowed:\n{}'.format(recorder.count, limit, recorder.report()))
+
+
+def query_budget(limit):
+    """
+    Declares the most statements a request to the decorated view may issue
+
+    The limit is an attribute of the view; decorators built with functools.wraps,
+    such as jwt_required, copy it, so the order of the decorators does not matter.
+    """
+    def decorator(fn):
+        fn.query_budget = limit
+        return fn
+    return decorator
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    recorders = getattr(_current, 'recorders', None)
+    if recorders:
+        for recorder in recorders:
+            recorder.record(statement)
+
+
+def _mode(app):
+    if QUERY_BUDGET_MODE is not None:
+        return QUERY_BUDGET_MODE
+    return MODE_RAISE if app.testing else MODE_WARN
+
+
+def _before_request():
+    recorder = Recorder()
+    _recorders().append(recorder)
+    _current.request_recorder = recorder
+
+
+def _end_request():
+    recorder = getattr(_current, 'request_recorder', None)
+    if recorder is not None:
+        _current.request_recorder = None
+        _recorders().remove(recorder)
+    return recorder
+
+
+def _after_request(response):
+    recorder = _end_request()
+    if recorder is None:
+        return response
+
+    endpoint = request.endpoint or UNMATCHED
+    for statement, count, sites in recorder.repeated():
+        repeated_statements.inc((endpoint,))
+        logger.warning('%s issued %d times in %s, repeated from %s', statement, count, endpoint,
+                       ', '.join('{} ({}x)'.format(site, site_count) for site, site_count in sites.most_common()))
+
+    view = current_app.view_functions.get(request.endpoint)
+    limit = getattr(view, 'query_budget', None)
+    if limit is None or recorder.count <= limit:
+        return response
+
+    budget_exceeded.inc((endpoint,))
+    message = '{} issued {} queries, {} allowed:\n{}'.format(endpoint, recorder.count, limit, recorder.report())
+    if _mode(current_app) == MODE_RAISE:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+    return response
+
+
+def _teardown_request(exception):
+    _end_request()
+
+
+def init_app(app):
+    # app.testing is usually set after the app is built, so only the override is checked here
+    if QUERY_BUDGET_MODE == MODE_OFF:
+        return
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
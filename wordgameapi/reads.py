@@ -0,0 +1,116 @@
+"""
+ORM-free read path for the hot GET endpoints
+
+Core statements return plain rows that are turned straight into the dicts the
+handlers serialize, skipping entity hydration and the identity map. The dicts
+carry exactly the fields of the dataclass models they replace, so responses
+do not change.
+"""
+from sqlalchemy import select, FLOAT
+from sqlalchemy.sql import text
+
+from .models import db, Category, Collection, Session
+
+WORST_PERFORMERS = text(
+    """
+    SELECT P.term_id, P.user_id, P.week, T.word,
+        COALESCE(ELT(T.gender, 'SUB:NOM:SIN:MAS', 'SUB:NOM:SIN:FEM', 'SUB:NOM:SIN:NEU'), 'SUB:NOM:SIN') AS tags,
+        P.seconds_correct / P.seconds AS confidence_factor,
+        P.corrects / (P.corrects + P.wrongs + P.wrongs) AS correct_factor
+    FROM `term_performance` AS P
+    JOIN `noun` AS T ON T.id = P.term_id
+    WHERE P.user_id = :user_id AND P.week >= :week AND P.wrongs > 0
+    ORDER BY confidence_factor, correct_factor
+    LIMIT 100
+    """
+).columns(confidence_factor=FLOAT, correct_factor=FLOAT)
+
+WEEKLY_PERFORMANCE = text(
+    """
+    SELECT `week`,
+        AVG(seconds_correct / seconds) AS confidence_factor,
+        AVG(corrects / (corrects + wrongs + wrongs)) AS correct_factor
+    FROM `term_performance`
+    WHERE user_id = :user_id AND week >= :week
+    GROUP BY `week`
+    """
+).columns(confidence_factor=FLOAT, correct_factor=FLOAT)
+
+
+def categories():
+    """
+    :return: Every category as dict(id, name)
+    """
+    rows = db.session.execute(select([Category.id, Category.name]))
+    return [dict(id=id_, name=name) for id_, name in rows]
+
+
+def collection(owner_id, collection_id):
+    """
+    :return: dict(id, name) of the collection, or None unless owned by `owner_id`
+    """
+    row = db.session.execute(
+        select([Collection.id, Collection.name])
+        .where(Collection.owner_id == owner_id)
+        .where(Collection.id == collection_id)
+    ).first()
+    return dict(id=row[0], name=row[1]) if row is not None else None
+
+
+def collections(owner_id):
+    """
+    :return: dict(id, name) of every collection owned by `owner_id`
+    """
+    rows = db.session.execute(select([Collection.id, Collection.name])
+                              .where(Collection.owner_id == owner_id))
+    return [dict(id=id_, name=name) for id_, name in rows]
+
+
+def latest_session(user_id):
+    """
+    :return: dict(id, cursor) of the most recent session of the user, or None
+    """
+    row = db.session.execute(
+        select([Session.id, Session.cursor])
+        .where(Session.user_id == user_id)
+        .order_by(Session.created_at.desc())
+        .limit(1)
+    ).first()
+    return dict(id=row[0], cursor=row[1]) if row is not None else None
+
+
+def session(session_id):
+    """
+    :return: dict(id, cursor) of the session, or None
+    """
+    row = db.session.execute(
+        select([Session.id, Session.cursor])
+        .where(Session.id == session_id)
+    ).first()
+    return dict(id=row[0], cursor=row[1]) if row is not None else None
+
+
+def worst_performers(user_id, week):
+    """
+    :return: Up to 100 terms the user answered worst since `week`, as PerformanceStat fields
+    """
+    rows = db.session.execute(WORST_PERFORMERS, dict(user_id=user_id, week=week))
+    return [dict(term_id=row['term_id'],
+                 user_id=row['user_id'],
+                 week=row['week'],
+                 word=row['word'],
+                 tags=row['tags'],
+                 confidence_factor=row['confidence_factor'],
+                 correct_factor=row['correct_factor'])
+            for row in rows]
+
+
+def weekly_performance(user_id, week):
+    """
+    :return: Average factors of the user per week since `week`
+    """
+    rows = db.session.execute(WEEKLY_PERFORMANCE, dict(user_id=user_id, week=week))
+    return [dict(week=row['week'],
+                 confidence_factor=float(row['confidence_factor']),
+                 correct_factor=float(row['correct_factor']))
+            for row in rows]
@@ -0,0 +1,153 @@
+"""
+In-process indexes over the noun dictionary for /api/search
+
+Words are case-folded and kept sorted, so a prefix query is one bisect plus a
+scan of at most `limit` entries; fuzzy queries go through a FuzzyIndex. Each
+worker process builds its indexes on first use and a background thread
+rebuilds them whenever the dictionary version changes; queries keep using the
+previous indexes until the new ones are swapped in. With a dictionary snapshot
+loaded, the words and the version come from it instead of MySQL.
+"""
+import os
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+from threading import Lock, Thread
+from time import sleep
+
+from flask import current_app
+
+from .models import db
+from .fuzzy import FuzzyIndex
+from . import dictionary, snapshot
+
+SEARCH_DEFAULT_LIMIT = int(os.getenv('SEARCH_DEFAULT_LIMIT', 20))
+SEARCH_MAX_LIMIT = int(os.getenv('SEARCH_MAX_LIMIT', 200))
+# Seconds between checks of the dictionary version
+SEARCH_REFRESH_INTERVAL = float(os.getenv('SEARCH_REFRESH_INTERVAL', 60))
+
+logger = logging.getLogger(__name__)
+
+
+class PrefixIndex:
+    __slots__ = ('keys', 'ids', 'words')
+
+    def __init__(self, rows):
+        """
+        :param rows: (id, word, ...) tuples
+        """
+        entries = sorted((row[1].casefold(), row[0], row[1]) for row in rows)
+        self.keys = [key for key, _, _ in entries]
+        self.ids = array('i', (id_ for _, id_, _ in entries))
+        self.words = [word for _, _, word in entries]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def search(self, prefix, limit, after=None):
+        """
+        :param after: (word, id) of the last match of the previous page
+        :return: Up to `limit` (id, word) matches in (case-folded word, id) order, and whether more follow
+        """
+        prefix = prefix.casefold()
+        start = bisect_left(self.keys, prefix)
+        if after is not None:
+            word, id_ = after
+            key = word.casefold()
+            # Entries sharing a case-folded word are ordered by id, resume after `id_` among them
+            lo = bisect_left(self.keys, key)
+            hi = bisect_right(self.keys, key, lo)
+            start = max(start, bisect_right(self.ids, id_, lo, hi))
+
+        matches = []
+        for position in range(start, min(start + limit + 1, len(self.keys))):
+            if not self.keys[position].startswith(prefix):
+                break
+            matches.append((self.ids[position], self.words[position]))
+
+        return matches[:limit], len(matches) > limit
+
+
+class Indexes:
+    __slots__ = ('version', 'prefix', 'fuzzy')
+
+    def __init__(self, version, prefix, fuzzy):
+        self.version = version
+        self.prefix = prefix
+        self.fuzzy = fuzzy
+
+
+_lock = Lock()
+_indexes = None
+_refresher_pid = None
+
+
+def _version():
+    dictionary_snapshot = snapshot.current()
+    if dictionary_snapshot is not None:
+        return dictionary_snapshot.version
+    return dictionary.version()
+
+
+def _build():
+    dictionary_snapshot = snapshot.current()
+    if dictionary_snapshot is None:
+        version = dictionary.version()
+        nouns = dictionary.nouns()
+        return Indexes(version, PrefixIndex(nouns), FuzzyIndex(nouns, dictionary.frequencies()))
+
+    nouns = dictionary_snapshot.nouns()
+    try:
+        frequencies = dictionary.frequencies()
+    except Exception:
+        # Frequencies only break ties, searching works without MySQL
+        logger.exception('Reading term frequencies failed')
+        db.session.rollback()
+        frequencies = {}
+    return Indexes(dictionary_snapshot.version, PrefixIndex(nouns), FuzzyIndex(nouns, frequencies))
+
+
+def _refresh(app):
+    global _indexes
+    pid = os.getpid()
+    while _refresher_pid == pid:
+        sleep(SEARCH_REFRESH_INTERVAL)
+        try:
+            with app.app_context():
+                try:
+                    if _version() != _indexes.version:
+                        _indexes = _build()
+                        logger.info('Search indexes rebuilt for dictionary version %s', _indexes.version)
+                finally:
+                    db.session.remove()
+        except Exception:
+            logger.exception('Rebuilding the search indexes failed')
+
+
+def preload():
+    """
+    Build the indexes without starting the refresher, for a master process that forks workers
+    """
+    global _indexes
+    with _lock:
+        if _indexes is None:
+            _indexes = _build()
+
+
+def indexes():
+    """
+    :return: Search indexes of this process, built on first use
+    """
+    global _indexes, _refresher_pid
+    if _indexes is not None and _refresher_pid == os.getpid():
+        return _indexes
+
+    with _lock:
+        if _indexes is None:
+            _indexes = _build()
+        if _refresher_pid != os.getpid():
+            # Threads do not survive fork(), every worker runs its own refresher
+            _refresher_pid = os.getpid()
+            Thread(target=_refresh, args=(current_app._get_current_object(),),
+                   name='search-index', daemon=True).start()
+    return _indexes
@@ -0,0 +1,76 @@
+"""
+JSON encoding of responses with orjson when it is installed
+
+FastJSONEncoder is installed as `app.json_encoder`, so jsonify() keeps its
+behaviour (sorted keys, ASCII escapes, compact separators, dataclasses
+through JSONEncoder.default) while the encoding itself runs in orjson.
+Output is byte-identical to the stdlib encoder: non-ASCII characters are
+escaped afterwards, and anything orjson writes differently (floats in
+exponent notation or below 1e-4, integers beyond 64 bits, non-string keys)
+falls back to the stdlib encoder. The one exception is NaN/Infinity, which
+are not JSON and come out as null. JSON_BACKEND=json disables orjson.
+"""
+import os
+import re
+
+from flask.json import JSONEncoder
+
+from .instrumentation import phase
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_BACKEND = os.getenv('JSON_BACKEND', 'orjson')
+
+# Output orjson may have written differently from the stdlib: exponents and
+# small floats. Matches inside strings only cost a needless fallback.
+_SUSPECT = re.compile(rb'[0-9][eE]|0\.0000')
+_NON_ASCII = re.compile('[\x7f-\U0010ffff]')
+
+
+def _escape(match):
+    code = ord(match.group())
+    if code < 0x10000:
+        return '\\u{:04x}'.format(code)
+    code -= 0x10000
+    return '\\u{:04x}\\u{:04x}'.format(0xd800 | (code >> 10), 0xdc00 | (code & 0x3ff))
+
+
+def backend():
+    """
+    :return: Name of the JSON backend in use
+    """
+    return 'orjson' if orjson is not None and JSON_BACKEND == 'orjson' else 'json'
+
+
+class FastJSONEncoder(JSONEncoder):
+    def _orjson_compatible(self):
+        return (self.indent is None
+                and self.item_separator == ','
+                and self.key_separator == ':'
+                and not self.skipkeys)
+
+    def encode(self, o):
+        with phase('serialize'):
+            return self._encode(o)
+
+    def _encode(self, o):
+        if backend() != 'orjson' or not self._orjson_compatible():
+            return super().encode(o)
+
+        option = orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            data = orjson.dumps(o, default=self.default, option=option)
+        except TypeError:
+            return super().encode(o)
+
+        if _SUSPECT.search(data):
+            return super().encode(o)
+        text = data.decode('utf8')
+        if self.ensure_ascii:
+            text = _NON_ASCII.sub(_escape, text)
+        return text
@@ -0,0 +1,274 @@
+"""
+Host-wide shared-memory cache of categories and category decks
+
+Generations are immutable files in SHARED_CACHE_DIR (a tmpfs such as
+/dev/shm/wordgame) that every worker process mmap()s, so a host holds one
+copy however many workers it runs. A small control file carries the current
+generation number next to its complement; readers compare it with the
+generation they have mapped on every call and switch by mapping the new file,
+without taking any lock. One process per host, elected through a lock on
+`builder.lock`, rebuilds a generation when the dictionary version changes or
+the current one is older than SHARED_CACHE_MAX_AGE seconds; when it exits,
+another worker takes over.
+
+Generation layout, little endian, sections aligned to 4 bytes:
+
+    header            magic, generation, dictionary version, build time, category, member and name sizes
+    category_ids      int32[categories], ascending
+    name_offsets      uint32[categories + 1] into names
+    deck_offsets      uint32[categories + 1] into members
+    members           int32[members], noun ids per category, ascending
+    names             UTF-8 category names
+"""
+import os
+import mmap
+import time
+import fcntl
+import struct
+import logging
+from array import array
+from threading import Lock, Thread
+from bisect import bisect_left
+
+from flask import current_app
+from sqlalchemy import select
+
+from .models import db, Category, CategoryNoun
+from . import dictionary
+
+SHARED_CACHE_DIR = os.getenv('SHARED_CACHE_DIR', None)
+# Seconds between builder checks, also how often non-builders try to take over
+SHARED_CACHE_REFRESH_INTERVAL = float(os.getenv('SHARED_CACHE_REFRESH_INTERVAL', 30))
+# Seconds after which a generation is rebuilt to pick up category changes
+SHARED_CACHE_MAX_AGE = float(os.getenv('SHARED_CACHE_MAX_AGE', 300))
+
+MAGIC = b'WGSHM001'
+HEADER = struct.Struct('<8sQIdIII')
+HEADER_SIZE = 48
+# Generation number and its complement, a torn read fails the check
+CONTROL = struct.Struct('<QQ')
+MASK = 0xFFFFFFFFFFFFFFFF
+
+logger = logging.getLogger(__name__)
+
+
+def _align(size):
+    return (size + 3) & ~3
+
+
+def _path(name):
+    return os.path.join(SHARED_CACHE_DIR, name)
+
+
+def _generation_path(generation):
+    return _path('gen-{}'.format(generation))
+
+
+class Generation:
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(self._mmap)
+        (magic, self.generation, self.dictionary_version, self.built_at,
+         category_count, member_count, names_size) = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError('Not a shared cache generation: {}'.format(path))
+
+        offset = HEADER_SIZE
+
+        def section(size, format_):
+            nonlocal offset
+            data = view[offset:offset + size]
+            offset += _align(size)
+            return data.cast(format_) if format_ != 'B' else data
+
+        self.category_ids = section(category_count * 4, 'i')
+        self._name_offsets = section((category_count + 1) * 4, 'I')
+        self._deck_offsets = section((category_count + 1) * 4, 'I')
+        self._members = section(member_count * 4, 'i')
+        self._names = section(names_size, 'B')
+
+    def __len__(self):
+        return len(self.category_ids)
+
+    def categories(self):
+        """
+        :return: Every category as dict(id, name), by id
+        """
+        return [dict(id=self.category_ids[position],
+                     name=str(self._names[self._name_offsets[position]:self._name_offsets[position + 1]], 'utf8'))
+                for position in range(len(self.category_ids))]
+
+    def deck(self, category_id):
+        """
+        :return: Noun ids of the category in ascending order, or None for a category unknown to this generation
+        """
+        position = bisect_left(self.category_ids, category_id)
+        if position == len(self.category_ids) or self.category_ids[position] != category_id:
+            return None
+        return self._members[self._deck_offsets[position]:self._deck_offsets[position + 1]]
+
+
+def _write(generation, dictionary_version, categories, decks):
+    """
+    :param categories: (id, name) tuples by id
+    :param decks: Mapping of category id to ascending noun ids
+    """
+    category_ids = array('i', (id_ for id_, _ in categories))
+    names = bytearray()
+    name_offsets = array('I', [0])
+    deck_offsets = array('I', [0])
+    members = array('i')
+    for id_, name in categories:
+        names += name.encode('utf8')
+        name_offsets.append(len(names))
+        members.extend(decks.get(id_, ()))
+        deck_offsets.append(len(members))
+
+    path = _generation_path(generation)
+    temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(temporary_path, 'wb') as file:
+            header = HEADER.pack(MAGIC, generation, dictionary_version, time.time(),
+                                 len(category_ids), len(members), len(names))
+            file.write(header.ljust(HEADER_SIZE, b'\0'))
+            for section in (category_ids.tobytes(), name_offsets.tobytes(), deck_offsets.tobytes(),
+                            members.tobytes(), bytes(names)):
+                file.write(section)
+                file.write(b'\0' * (_align(len(section)) - len(section)))
+        os.replace(temporary_path, path)
+    except BaseException:
+        try:
+            os.unlink(temporary_path)
+        except OSError:
+            pass
+        raise
+
+
+_lock = Lock()
+_control = None
+_generation = None
+_builder_pid = None
+
+
+def _map_control():
+    fd = os.open(_path('control'), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.fstat(fd).st_size < CONTROL.size:
+            os.ftruncate(fd, CONTROL.size)
+        return mmap.mmap(fd, CONTROL.size)
+    finally:
+        os.close(fd)
+
+
+def _published():
+    """
+    :return: Generation number in the control file, None while none is published
+    """
+    generation, check = CONTROL.unpack_from(_control)
+    if generation == 0 or generation ^ check != MASK:
+        return None
+    return generation
+
+
+def _publish(generation):
+    CONTROL.pack_into(_control, 0, generation, generation ^ MASK)
+
+
+def _refresh():
+    published = current()
+    version = dictionary.version()
+    if (published is not None and published.dictionary_version == version
+            and time.time() - published.built_at < SHARED_CACHE_MAX_AGE):
+        return
+
+    categories = list(db.session.execute(select([Category.id, Category.name]).order_by(Category.id)))
+    decks = dict()
+    for category_id, noun_id in db.session.execute(
+            select([CategoryNoun.category_id, CategoryNoun.noun_id])
+            .order_by(CategoryNoun.category_id, CategoryNoun.noun_id)):
+        decks.setdefault(category_id, array('i')).append(noun_id)
+
+    generation = (_published() or 0) + 1
+    _write(generation, version, categories, decks)
+    _publish(generation)
+    logger.info('Shared cache generation %s built for dictionary version %s', generation, version)
+
+    # Mapped generations stay readable after unlink; keep the previous one for
+    # readers that have just read the control file
+    for name in os.listdir(SHARED_CACHE_DIR):
+        if name.startswith('gen-') and not name.endswith('.tmp') and int(name[4:]) < generation - 1:
+            os.unlink(_path(name))
+
+
+def _remove_temporary_files():
+    """
+    Delete the files a builder that died inside _write() left behind; only the elected builder writes
+    """
+    for name in os.listdir(SHARED_CACHE_DIR):
+        if name.endswith('.tmp'):
+            try:
+                os.unlink(_path(name))
+            except FileNotFoundError:
+                pass
+
+
+def _build(app):
+    pid = os.getpid()
+    # POSIX record locks are per process and not inherited by forked children
+    lock_file = open(_path('builder.lock'), 'a')
+    elected = False
+    while _builder_pid == pid:
+        if not elected:
+            try:
+                fcntl.lockf(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                elected = True
+                logger.info('Process %s builds the shared cache', pid)
+                _remove_temporary_files()
+            except OSError:
+                pass
+        if elected:
+            try:
+                with app.app_context():
+                    try:
+                        _refresh()
+                    finally:
+                        db.session.remove()
+            except Exception:
+                logger.exception('Building the shared cache failed')
+        time.sleep(SHARED_CACHE_REFRESH_INTERVAL)
+
+
+def _start():
+    global _control, _builder_pid
+    with _lock:
+        if _builder_pid != os.getpid():
+            os.makedirs(SHARED_CACHE_DIR, exist_ok=True)
+            _control = _map_control()
+            # Threads do not survive fork(), every worker runs its own builder candidate
+            _builder_pid = os.getpid()
+            Thread(target=_build, args=(current_app._get_current_object(),),
+                   name='shared-cache', daemon=True).start()
+
+
+def current():
+    """
+    :return: Latest published generation, or None without SHARED_CACHE_DIR or before the first build
+    """
+    global _generation
+    if SHARED_CACHE_DIR is None:
+        return None
+    if _builder_pid != os.getpid():
+        _start()
+
+    generation = _published()
+    if generation is None or (_generation is not None and _generation.generation == generation):
+        return _generation
+
+    try:
+        _generation = Generation(_generation_path(generation))
+    except (OSError, ValueError):
+        # Superseded and removed while we were switching, the next call catches up
+        pass
+    return _generation
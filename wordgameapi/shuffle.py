@@ -0,0 +1,47 @@
+"""
+Seeded pseudorandom permutation of range(count) with O(1) random access
+
+A balanced Feistel network over the smallest even-width bit domain covering
+`count` is a bijection on that domain; cycle-walking (re-encrypting until
+the value falls back into range) restricts it to a bijection on
+range(count). The domain is less than 4 * count, so the expected number of
+walks is small and independent of the position.
+"""
+from random import getrandbits
+
+SEED_BITS = 32
+ROUNDS = 4
+
+
+def new_seed():
+    return getrandbits(SEED_BITS) or 1
+
+
+def _mix(value, seed, round_):
+    # 32 bit integer finalizer (murmur3 style) keyed by seed and round
+    x = (value * 0x9E3779B1 + seed * 0x85EBCA77 + round_ * 0xC2B2AE3D) & 0xFFFFFFFF
+    x ^= x >> 16
+    x = (x * 0x7FEB352D) & 0xFFFFFFFF
+    x ^= x >> 15
+    x = (x * 0x846CA68B) & 0xFFFFFFFF
+    x ^= x >> 16
+    return x
+
+
+def permute(index, count, seed):
+    """
+    :return: Position of the `index`-th element of range(count) shuffled by `seed`
+    """
+    if not 0 <= index < count:
+        raise IndexError('index out of range')
+
+    half = max(1, ((count - 1).bit_length() + 1) // 2)
+    mask = (1 << half) - 1
+    value = index
+    while True:
+        left, right = value >> half, value & mask
+        for round_ in range(ROUNDS):
+            left, right = right, left ^ (_mix(right, seed, round_) & mask)
+        value = (left << half) | right
+        if value < count:
+            return value
@@ -0,0 +1,167 @@
+"""
+Slow-query log
+
+Statements running longer than SLOW_QUERY_THRESHOLD seconds are logged with
+their normalized SQL (literals and placeholders replaced by ?), the types of
+their bound parameters (never the values), the duration and the endpoint and
+code that issued them. The first SLOW_QUERY_EXPLAIN occurrences of each
+normalized statement are also EXPLAINed on the same connection, right after
+the statement. The last SLOW_QUERY_LOG_SIZE entries are kept in memory for
+/api/admin/slow-queries.
+
+Disabled with SLOW_QUERY_THRESHOLD=0.
+"""
+import os
+import re
+import logging
+from collections import deque
+from datetime import datetime
+from threading import Lock, local
+from timeit import default_timer
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import metrics
+from .instrumentation import INTERNAL_MODULES, BACKGROUND, call_site, current
+
+SLOW_QUERY_THRESHOLD = float(os.getenv('SLOW_QUERY_THRESHOLD', 0.1))
+SLOW_QUERY_EXPLAIN = int(os.getenv('SLOW_QUERY_EXPLAIN', 1))
+SLOW_QUERY_LOG_SIZE = int(os.getenv('SLOW_QUERY_LOG_SIZE', 200))
+# Normalized statements whose occurrences are counted; once full, new statements are not EXPLAINed
+SLOW_QUERY_MAX_STATEMENTS = int(os.getenv('SLOW_QUERY_MAX_STATEMENTS', 1000))
+
+EXPLAINABLE = ('select', 'insert', 'update', 'delete', 'replace')
+
+INTERNAL_MODULES.add(__name__)
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_PLACEHOLDER = re.compile(r'%\(\w+\)s|%s|\?')
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_ROWS = re.compile(r'\(\?\+\)(?:\s*,\s*\(\?\+\))+')
+_SPACE = re.compile(r'\s+')
+
+slow_statements = metrics.Counter('db_slow_statements_total',
+                                  'Statements slower than SLOW_QUERY_THRESHOLD by endpoint', ('endpoint',))
+
+entries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+# Normalized statement to the number of slow occurrences
+occurrences = dict()
+
+_lock = Lock()
+_current = local()
+
+
+def normalize(statement):
+    """
+    :return: Statement with literals and placeholders replaced, so that executions differing only in values match
+    """
+    statement = _STRING.sub('?', statement)
+    statement = _PLACEHOLDER.sub('?', statement)
+    statement = _NUMBER.sub('?', statement)
+    statement = _LIST.sub('(?+)', statement)
+    statement = _ROWS.sub('(?+), ...', statement)
+    return _SPACE.sub(' ', statement).strip()
+
+
+def _type_of(value):
+    return 'null' if value is None else type(value).__name__
+
+
+def parameter_shape(parameters, executemany=False):
+    """
+    :return: Types of the bound parameters, e.g. ['int', 'str'] or {'user_id': 'str'}
+    """
+    if executemany:
+        parameters = list(parameters)
+        return dict(rows=len(parameters), row=parameter_shape(parameters[0]) if parameters else None)
+    if isinstance(parameters, dict):
+        return {key: _type_of(value) for key, value in parameters.items()}
+    if parameters is None:
+        return []
+    return [_type_of(value) for value in parameters]
+
+
+def _plain(value):
+    return value if value is None or isinstance(value, (str, int, float)) else str(value)
+
+
+def _explain(cursor, statement, parameters, executemany):
+    """
+    :return: EXPLAIN rows as dicts, None if the statement cannot be explained
+    """
+    if not statement.lstrip().lower().startswith(EXPLAINABLE):
+        return None
+    if executemany:
+        parameters = next(iter(parameters), None)
+    # A DBAPI cursor of its own: it neither disturbs the results being read nor fires cursor events
+    explain = cursor.connection.cursor()
+    try:
+        explain.execute('EXPLAIN ' + statement, parameters)
+        columns = [column[0] for column in explain.description]
+        return [{column: _plain(value) for column, value in zip(columns, row)} for row in explain.fetchall()]
+    finally:
+        explain.close()
+
+
+def _should_explain(normalized):
+    with _lock:
+        count = occurrences.get(normalized)
+        if count is None:
+            if len(occurrences) >= SLOW_QUERY_MAX_STATEMENTS:
+                return False
+            count = 0
+        occurrences[normalized] = count + 1
+        return count < SLOW_QUERY_EXPLAIN
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _current.started = default_timer()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = default_timer() - _current.started
+    if SLOW_QUERY_THRESHOLD <= 0 or elapsed < SLOW_QUERY_THRESHOLD:
+        return
+
+    stats = current()
+    endpoint = BACKGROUND if stats is None else stats.endpoint
+    normalized = normalize(statement)
+    entry = dict(time=datetime.utcnow().isoformat(),
+                 duration_ms=round(elapsed * 1000, 3),
+                 endpoint=endpoint,
+                 call_site=call_site(),
+                 statement=normalized,
+                 parameters=parameter_shape(parameters, executemany),
+                 plan=None)
+    slow_statements.inc((endpoint,))
+    logger.warning('Slow query (%.1f ms) in %s at %s: %s %s',
+                   entry['duration_ms'], endpoint, entry['call_site'], normalized, entry['parameters'])
+
+    if _should_explain(normalized):
+        try:
+            entry['plan'] = _explain(cursor, statement, parameters, executemany)
+        except Exception:
+            logger.exception('EXPLAIN failed: %s', normalized)
+
+    with _lock:
+        entries.append(entry)
+
+
+def recent():
+    """
+    :return: Slow queries kept in memory, newest first
+    """
+    with _lock:
+        return list(reversed(entries))
+
+
+def reset():
+    with _lock:
+        entries.clear()
+        occurrences.clear()
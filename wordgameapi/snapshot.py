@@ -0,0 +1,209 @@
+"""
+Read-only binary snapshot of the noun dictionary
+
+The file is mmap()ed, so every worker process on a host shares one copy
+through the page cache, and word and deck lookups keep working while MySQL
+is unavailable. Built with `python manage.py build_snapshot <path>` and
+loaded from DICTIONARY_SNAPSHOT.
+
+Layout, little endian, every section aligned to 4 bytes:
+
+    header            magic, dictionary version, noun, category, member and blob sizes
+    ids               int32[nouns], ascending
+    word_offsets      uint32[nouns + 1] into blob
+    genders           uint8[nouns], 0 for none
+    category_ids      int32[categories], ascending
+    category_offsets  uint32[categories + 1] into members
+    members           int32[members], noun ids per category, ascending
+    blob              UTF-8 words
+"""
+import os
+import mmap
+import struct
+import logging
+from array import array
+from bisect import bisect_left
+from threading import Lock
+from timeit import default_timer
+
+from sqlalchemy.sql import text
+
+from .models import db, CategoryNoun, GENDER_TAGS, NOUN_TAGS
+from . import dictionary
+
+DICTIONARY_SNAPSHOT = os.getenv('DICTIONARY_SNAPSHOT', None)
+# Seconds between checks for a rebuilt snapshot file
+SNAPSHOT_CHECK_INTERVAL = float(os.getenv('SNAPSHOT_CHECK_INTERVAL', 30))
+
+MAGIC = b'WGDICT01'
+HEADER = struct.Struct('<8sIIIII')
+HEADER_SIZE = 32
+
+logger = logging.getLogger(__name__)
+
+
+def _align(size):
+    return (size + 3) & ~3
+
+
+def write(path, version, nouns, categories):
+    """
+    Write a snapshot atomically
+
+    :param nouns: (id, word, gender) tuples
+    :param categories: Mapping of category id to noun ids
+    """
+    nouns = sorted(nouns)
+    ids = array('i', (id_ for id_, _, _ in nouns))
+    blob = bytearray()
+    word_offsets = array('I', [0])
+    for _, word, _ in nouns:
+        blob += word.encode('utf8')
+        word_offsets.append(len(blob))
+    genders = bytes(gender or 0 for _, _, gender in nouns)
+
+    category_ids = array('i', sorted(categories))
+    category_offsets = array('I', [0])
+    members = array('i')
+    for category_id in category_ids:
+        members.extend(sorted(categories[category_id]))
+        category_offsets.append(len(members))
+
+    sections = [ids.tobytes(), word_offsets.tobytes(), genders,
+                category_ids.tobytes(), category_offsets.tobytes(), members.tobytes(), bytes(blob)]
+
+    temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary_path, 'wb') as file:
+        header = HEADER.pack(MAGIC, version, len(ids), len(category_ids), len(members), len(blob))
+        file.write(header.ljust(HEADER_SIZE, b'\0'))
+        for section in sections:
+            file.write(section)
+            file.write(b'\0' * (_align(len(section)) - len(section)))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+
+
+def build(path):
+    """
+    Export the current noun dictionary to a snapshot at `path`
+
+    :return: Dictionary version of the snapshot
+    """
+    version = db.session.execute(text("SELECT version FROM `dictionary_version` WHERE id = 1")).scalar() or 0
+    categories = dict()
+    for category_id, noun_id in db.session.query(CategoryNoun.category_id, CategoryNoun.noun_id):
+        categories.setdefault(category_id, []).append(noun_id)
+    write(path, version, dictionary.nouns(), categories)
+    return version
+
+
+class Snapshot:
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.inode = os.fstat(file.fileno()).st_ino
+
+        view = memoryview(self._mmap)
+        if len(view) < HEADER_SIZE:
+            raise ValueError('Truncated dictionary snapshot: {}'.format(path))
+        magic, self.version, count, category_count, member_count, blob_size = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError('Not a dictionary snapshot: {}'.format(path))
+
+        offset = HEADER_SIZE
+
+        def section(size, format_):
+            nonlocal offset
+            if offset + size > len(view):
+                raise ValueError('Truncated dictionary snapshot: {}'.format(path))
+            data = view[offset:offset + size]
+            offset += _align(size)
+            return data.cast(format_) if format_ != 'B' else data
+
+        self.ids = section(count * 4, 'i')
+        self._word_offsets = section((count + 1) * 4, 'I')
+        self._genders = section(count, 'B')
+        self._category_ids = section(category_count * 4, 'i')
+        self._category_offsets = section((category_count + 1) * 4, 'I')
+        self._members = section(member_count * 4, 'i')
+        self._blob = section(blob_size, 'B')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _position(self, id_):
+        position = bisect_left(self.ids, id_)
+        if position < len(self.ids) and self.ids[position] == id_:
+            return position
+        return None
+
+    def _word(self, position):
+        return str(self._blob[self._word_offsets[position]:self._word_offsets[position + 1]], 'utf8')
+
+    def gender(self, position):
+        return self._genders[position] or None
+
+    def get_many(self, ids):
+        """
+        :return: Terms as dicts in the order of `ids`, unknown ids left out
+        """
+        terms = []
+        for id_ in ids:
+            position = self._position(id_)
+            if position is not None:
+                terms.append(dict(id=id_,
+                                  word=self._word(position),
+                                  tags=GENDER_TAGS.get(self._genders[position], NOUN_TAGS)))
+        return terms
+
+    def category_ids(self, category_id):
+        """
+        :return: Noun ids of the category in ascending order, a read-only int sequence
+        """
+        position = bisect_left(self._category_ids, category_id)
+        if position == len(self._category_ids) or self._category_ids[position] != category_id:
+            return self._members[0:0]
+        return self._members[self._category_offsets[position]:self._category_offsets[position + 1]]
+
+    def nouns(self):
+        """
+        :return: (id, word, gender) of every noun, by id
+        """
+        return [(self.ids[position], self._word(position), self.gender(position))
+                for position in range(len(self.ids))]
+
+
+_lock = Lock()
+_snapshot = None
+_checked_at = None
+
+
+def current():
+    """
+    :return: Snapshot of this process, or None without DICTIONARY_SNAPSHOT
+
+    A rebuilt file (new inode) is picked up within SNAPSHOT_CHECK_INTERVAL seconds.
+    """
+    global _snapshot, _checked_at
+    if DICTIONARY_SNAPSHOT is None:
+        return None
+
+    now = default_timer()
+    if _checked_at is not None and now - _checked_at < SNAPSHOT_CHECK_INTERVAL:
+        return _snapshot
+
+    with _lock:
+        if _checked_at is None or now - _checked_at >= SNAPSHOT_CHECK_INTERVAL:
+            _checked_at = now
+            try:
+                inode = os.stat(DICTIONARY_SNAPSHOT).st_ino
+                if _snapshot is None or _snapshot.inode != inode:
+                    _snapshot = Snapshot(DICTIONARY_SNAPSHOT)
+            except OSError:
+                # Keep serving the mapping we have
+                pass
+            except ValueError:
+                # Empty, truncated or not a snapshot: keep the mapping we have, or fall back to MySQL
+                logger.exception('Mapping dictionary snapshot %s failed', DICTIONARY_SNAPSHOT)
+    return _snapshot
@@ -0,0 +1,252 @@
+import os
+import math
+from bisect import bisect_right
+from operator import itemgetter
+
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy import tuple_
+from sqlalchemy.sql import case, func, text
+
+from .models import (
+    db, Session, Term, TermStat, TermPerformance, AnswerHistogram,
+    GENDER_MASCULINE, GENDER_FEMININE, GENDER_NEUTER,
+)
+
+# Lower bounds in seconds of the response time histogram buckets
+HISTOGRAM_BUCKETS = sorted(int(bound) for bound in
+                           os.getenv('HISTOGRAM_BUCKETS', '0,1,2,3,4,5,6,7,8,9,10,12,15,20,30,45,60,120').split(','))
+
+
+# Session report per game type: term_stat column grouped by, and labels of its values
+SESSION_REPORTS = {
+    'gender': ('gender', {GENDER_MASCULINE: 'der',
+                          GENDER_FEMININE: 'die',
+                          GENDER_NEUTER: 'das'}),
+}
+
+
+def bucket_for(seconds):
+    return HISTOGRAM_BUCKETS[max(0, bisect_right(HISTOGRAM_BUCKETS, seconds) - 1)]
+
+
+# Longest response time accepted for one answer
+MAX_ANSWER_SECONDS = 24 * 60 * 60
+MAX_TERM_ID = 2 ** 31 - 1
+
+
+def valid_term_id(term_id):
+    return not isinstance(term_id, bool) and isinstance(term_id, int) and 0 < term_id <= MAX_TERM_ID
+
+
+def valid_event(event):
+    """
+    :return: Whether an answer event can be folded into term_stat; checked before
+             the event is queued, since the write-behind flusher cannot reject it
+    """
+    if not isinstance(event, dict):
+        return False
+    if not valid_term_id(event.get('term_id')):
+        return False
+    session_id = event.get('session_id')
+    if not isinstance(session_id, str) or not 0 < len(session_id) <= 36:
+        return False
+    seconds = event.get('seconds', 1)
+    if isinstance(seconds, bool) or not isinstance(seconds, (int, float)) \
+            or not math.isfinite(seconds) or not 0 <= seconds <= MAX_ANSWER_SECONDS:
+        return False
+    return all(event.get(key) is None or isinstance(event.get(key), bool) for key in ('correct', 'skipped'))
+
+
+def _aggregate(events, week):
+    """
+    Fold answer events into one term_stat row per (session_id, term_id)
+    """
+    rows = dict()
+    for event in events:
+        key = (event.get('session_id'), event['term_id'])
+        correct = event.get('correct', None)
+        skipped = event.get('skipped', None)
+        seconds = event.get('seconds', 1)
+
+        row = rows.get(key)
+        if row is None:
+            row = rows[key] = dict(session_id=key[0],
+                                   term_id=key[1],
+                                   week=week,
+                                   corrects=0,
+                                   wrongs=0,
+                                   skippeds=0,
+                                   seconds=0,
+                                   seconds_correct=None)
+        row['corrects'] += 1 if correct == True else 0
+        row['wrongs'] += 1 if correct == False else 0
+        row['skippeds'] += 1 if skipped == True else 0
+        row['seconds'] += seconds
+        if correct == True:
+            row['seconds_correct'] = (row['seconds_correct'] or 0) + seconds
+
+    return list(rows.values())
+
+
+def _term_genders(term_ids):
+    return dict(db.session.query(Term.id, Term.gender)
+                .filter(Term.id.in_(term_ids)))
+
+
+def _upsert(table, key, rows, counters, nullable_counters=()):
+    """
+    Multi-row INSERT ... ON DUPLICATE KEY UPDATE adding up `counters`
+
+    Rows are inserted in the order of `key`, the columns of the unique key
+    they collide on, so concurrent upserts lock shared rows in the same order
+    instead of deadlocking. `nullable_counters` stay NULL until a non-NULL
+    value is added.
+    """
+    rows = sorted(rows, key=itemgetter(*key))
+    stmt = insert(table).values(rows)
+    updates = {name: table.c[name] + stmt.inserted[name] for name in counters}
+    for name in nullable_counters:
+        updates[name] = case([(stmt.inserted[name].is_(None), table.c[name])],
+                             else_=func.ifnull(table.c[name], 0) + stmt.inserted[name])
+    db.session.execute(stmt.on_duplicate_key_update(**updates))
+
+
+def _session_owners(session_ids):
+    """
+    :return: user_id by session id, guest sessions left out
+    """
+    return dict(db.session.query(Session.id, Session.user_id)
+                .filter(Session.id.in_(session_ids),
+                        Session.user_id.isnot(None)))
+
+
+def _term_stat_weeks(rows):
+    """
+    :return: Week of the term_stat row by (session_id, term_id), the week the session first answered the term
+
+    The rollups file answers under this week rather than the week of the batch,
+    the way their backfills from term_stat do.
+    """
+    keys = [(row['session_id'], row['term_id']) for row in rows]
+    return {(session_id, term_id): week for session_id, term_id, week in
+            db.session.query(TermStat.session_id, TermStat.term_id, TermStat.week)
+            .filter(tuple_(TermStat.session_id, TermStat.term_id).in_(keys))}
+
+
+def _performance_rows(rows, user_ids, weeks):
+    """
+    Fold term_stat rows of user sessions into term_performance rows
+    """
+    performance = dict()
+    for row in rows:
+        user_id = user_ids.get(row['session_id'])
+        if user_id is None:
+            continue
+        week = weeks[(row['session_id'], row['term_id'])]
+        key = (user_id, row['term_id'], week)
+        item = performance.get(key)
+        if item is None:
+            item = performance[key] = dict(user_id=user_id,
+                                           term_id=row['term_id'],
+                                           week=week,
+                                           corrects=0,
+                                           wrongs=0,
+                                           seconds=0,
+                                           seconds_correct=None)
+        item['corrects'] += row['corrects']
+        item['wrongs'] += row['wrongs']
+        item['seconds'] += row['seconds']
+        if row['seconds_correct'] is not None:
+            item['seconds_correct'] = (item['seconds_correct'] or 0) + row['seconds_correct']
+
+    return list(performance.values())
+
+
+def _histogram_rows(events, user_ids, weeks):
+    """
+    Count answer events of user sessions per response time bucket, each under the week of its term_stat row
+    """
+    histogram = dict()
+    for event in events:
+        user_id = user_ids.get(event.get('session_id'))
+        if user_id is None:
+            continue
+        key = (user_id, weeks[(event['session_id'], event['term_id'])], bucket_for(event.get('seconds', 1)))
+        item = histogram.get(key)
+        if item is None:
+            item = histogram[key] = dict(user_id=user_id,
+                                         week=key[1],
+                                         bucket=key[2],
+                                         correct_count=0,
+                                         wrong_count=0)
+        if event.get('correct', None) == True:
+            item['correct_count'] += 1
+        else:
+            item['wrong_count'] += 1
+
+    return list(histogram.values())
+
+
+def upsert_term_stats(events, week, commit=True):
+    """
+    Apply answer events with a single multi-row INSERT ... ON DUPLICATE KEY UPDATE
+
+    Relies on the unique index on term_stat(session_id, term_id). The
+    term_performance rollup and the answer histogram of signed-in users are
+    updated in the same transaction, each table's rows sorted by its unique
+    key so concurrent batches lock them in the same order.
+
+    :param commit: False leaves the transaction open, for callers applying several batches at once
+    """
+    rows = _aggregate(events, week)
+    if len(rows) == 0:
+        return 0
+
+    genders = _term_genders({row['term_id'] for row in rows})
+    for row in rows:
+        row['gender'] = genders.get(row['term_id'])
+
+    _upsert(TermStat.__table__, ('session_id', 'term_id'), rows,
+            ('corrects', 'wrongs', 'skippeds', 'seconds'), ('seconds_correct',))
+
+    user_ids = _session_owners({row['session_id'] for row in rows})
+    if len(user_ids) > 0:
+        weeks = _term_stat_weeks([row for row in rows if row['session_id'] in user_ids])
+        _upsert(TermPerformance.__table__, ('user_id', 'term_id', 'week'), _performance_rows(rows, user_ids, weeks),
+                ('corrects', 'wrongs', 'seconds'), ('seconds_correct',))
+        _upsert(AnswerHistogram.__table__, ('user_id', 'week', 'bucket'), _histogram_rows(events, user_ids, weeks),
+                ('correct_count', 'wrong_count'))
+
+    if commit:
+        db.session.commit()
+
+    return len(rows)
+
+
+def session_report(session_id):
+    """
+    Corrects and wrongs of a session grouped by the report column of its game type
+    """
+    game_type = (db.session.query(Session.game_type)
+                 .filter(Session.id == session_id)
+                 .scalar()) or 'gender'
+    if game_type not in SESSION_REPORTS:
+        return {}
+
+    column, labels = SESSION_REPORTS[game_type]
+    rows = db.session.execute(text(
+        """
+        SELECT `{column}` AS code, SUM(corrects) AS corrects, SUM(wrongs) AS wrongs
+        FROM `term_stat`
+        WHERE session_id = :session_id AND `{column}` IS NOT NULL
+        GROUP BY `{column}`
+        """.format(column=column)
+        ),
+        dict(session_id=session_id))
+
+    report = {label: dict(corrects=0, wrongs=0) for label in labels.values()}
+    for row in rows:
+        if row['code'] in labels:
+            report[labels[row['code']]] = dict(corrects=int(row['corrects']),
+                                               wrongs=int(row['wrongs']))
+    return report
@@ -0,0 +1,77 @@
+"""
+Compact in-process store for id -> (word, gender) lookups
+
+Hot handlers serialize only id, word and tags, so rather than ORM `Term`
+instances with their identity map and instance state, a process keeps the
+dictionary as a sorted int array, a list of interned words and one gender byte
+per term; tags come from the shared GENDER_TAGS strings. The store is built on
+first use and rebuilt when the dictionary version changes. When a dictionary
+snapshot is loaded it is used instead, as it offers the same `get_many`.
+"""
+import sys
+from array import array
+from bisect import bisect_left
+from threading import Lock
+
+from .models import GENDER_TAGS, NOUN_TAGS
+from . import dictionary, snapshot
+
+
+class TermStore:
+    __slots__ = ('version', 'ids', 'words', 'genders')
+
+    def __init__(self, rows, version=None):
+        """
+        :param rows: (id, word, gender) tuples
+        """
+        rows = sorted(rows)
+        self.version = version
+        self.ids = array('i', (row[0] for row in rows))
+        self.words = [sys.intern(row[1]) for row in rows]
+        self.genders = bytes(row[2] or 0 for row in rows)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_many(self, term_ids):
+        """
+        :return: Terms as dicts in the order of `term_ids`, unknown ids left out
+        """
+        ids, words, genders = self.ids, self.words, self.genders
+        count = len(ids)
+        terms = []
+        for term_id in term_ids:
+            position = bisect_left(ids, term_id)
+            if position < count and ids[position] == term_id:
+                terms.append(dict(id=term_id,
+                                  word=words[position],
+                                  tags=GENDER_TAGS.get(genders[position], NOUN_TAGS)))
+        return terms
+
+
+_lock = Lock()
+_store = None
+
+
+def store():
+    """
+    :return: Term store of this process: the dictionary snapshot if loaded, else a TermStore
+    """
+    global _store
+    dictionary_snapshot = snapshot.current()
+    if dictionary_snapshot is not None:
+        return dictionary_snapshot
+
+    version = dictionary.version()
+    if _store is not None and _store.version == version:
+        return _store
+
+    # One thread rebuilds, the others keep answering from the previous store
+    if not _lock.acquire(blocking=_store is None):
+        return _store
+    try:
+        if _store is None or _store.version != version:
+            _store = TermStore(dictionary.nouns(), version)
+    finally:
+        _lock.release()
+    return _store
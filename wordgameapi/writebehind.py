@@ -0,0 +1,408 @@
+"""
+Write-behind buffer for answer events
+
+Events are appended to a local segment file and acknowledged right away; a
+background thread applies sealed segments to `term_stat` once a segment holds
+WRITE_BEHIND_FLUSH_SIZE events or WRITE_BEHIND_FLUSH_INTERVAL seconds have
+passed. Every open segment is flock()ed by the process owning it, so segments
+left behind by a crashed process are recognized by their missing lock and
+replayed. Delivery is at-least-once: a crash between applying a segment and
+deleting it replays that segment.
+
+A segment that keeps failing while the database is reachable (say, an event
+violating a constraint) is renamed to *.bad after WRITE_BEHIND_MAX_ATTEMPTS
+flushes, so it does not hold up the segments behind it. Events are written
+under a lock of their own and fsync()ed with group commit: one waiting append
+syncs the writes of all the appends that queued up meanwhile. The lock
+guarding the counters is never held across disk I/O.
+
+Enabled by setting WRITE_BEHIND_DIR.
+"""
+import os
+import json
+import fcntl
+import logging
+from collections import defaultdict
+from itertools import count
+from threading import Condition, Lock, Thread
+from time import time
+from timeit import default_timer
+
+from sqlalchemy.sql import text
+
+from . import metrics
+from .models import db
+from .stats import upsert_term_stats
+
+WRITE_BEHIND_DIR = os.getenv('WRITE_BEHIND_DIR', None)
+WRITE_BEHIND_FLUSH_SIZE = int(os.getenv('WRITE_BEHIND_FLUSH_SIZE', 500))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', 2))
+# Events accepted but not yet applied before appends start blocking
+WRITE_BEHIND_MAX_PENDING = int(os.getenv('WRITE_BEHIND_MAX_PENDING', 20000))
+# Seconds an append waits for room before it is rejected
+WRITE_BEHIND_BLOCK_TIMEOUT = float(os.getenv('WRITE_BEHIND_BLOCK_TIMEOUT', 0.5))
+WRITE_BEHIND_FSYNC = os.getenv('WRITE_BEHIND_FSYNC', '1') != '0'
+# Failed flushes, with the database reachable, before a segment is set aside
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv('WRITE_BEHIND_MAX_ATTEMPTS', 5))
+
+RECOVERY_INTERVAL = 30
+SEGMENT_SUFFIX = '.seg'
+QUARANTINE_SUFFIX = '.bad'
+
+logger = logging.getLogger(__name__)
+
+buffer = None
+
+
+class BufferFull(Exception):
+    pass
+
+
+class Segment:
+    def __init__(self, path, file, size=0):
+        self.path = path
+        self.file = file
+        self.size = size
+        self.failures = 0
+
+    def close(self):
+        self.file.close()
+
+
+class WriteBehindBuffer:
+    def __init__(self, app, directory,
+                 flush_size=WRITE_BEHIND_FLUSH_SIZE,
+                 flush_interval=WRITE_BEHIND_FLUSH_INTERVAL,
+                 max_pending=WRITE_BEHIND_MAX_PENDING,
+                 block_timeout=WRITE_BEHIND_BLOCK_TIMEOUT,
+                 fsync=WRITE_BEHIND_FSYNC,
+                 max_attempts=WRITE_BEHIND_MAX_ATTEMPTS):
+        self.app = app
+        self.directory = directory
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.block_timeout = block_timeout
+        self.fsync = fsync
+        self.max_attempts = max_attempts
+
+        self._cond = Condition()
+        # Serializes writes to the current segment and sealing it; taken before _cond
+        self._write_lock = Lock()
+        # Group commit: appends numbered by _written wait until _synced reaches their number
+        self._sync_cond = Condition()
+        # Held while fsync()ing, segments are closed under it
+        self._sync_lock = Lock()
+        self._written = 0
+        self._synced = 0
+        self._syncing = False
+        # Segments written to since the last fsync()
+        self._dirty = set()
+        self._pid = None
+        self._sequence = count()
+        self._current = None
+        self._sealed = []
+        self._pending = 0
+        self._last_recovery = 0
+
+        self.flushes = 0
+        self.flushed_events = 0
+        self.flush_errors = 0
+        self.rejected = 0
+        self.quarantined = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    def start(self):
+        """
+        Start the flusher of this process; a no-op once running
+
+        Threads do not survive fork(), so the pid tells whether this process
+        already owns a flusher.
+        """
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._sequence = count()
+            self._current = None
+            self._sealed = []
+            self._pending = 0
+            self._written = 0
+            self._synced = 0
+            self._syncing = False
+            self._dirty = set()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._recover()
+        Thread(target=self._run, name='write-behind', daemon=True).start()
+
+    def append(self, events, week):
+        """
+        Durably queue answer events
+
+        :raise BufferFull: when no room frees up within `block_timeout`
+        """
+        self.start()
+        lines = ''.join(json.dumps(dict(event, week=week)) + '\n' for event in events)
+
+        with self._cond:
+            deadline = default_timer() + self.block_timeout
+            while self._pending + len(events) > self.max_pending and self._pending > 0:
+                remaining = deadline - default_timer()
+                if remaining <= 0:
+                    self.rejected += len(events)
+                    raise BufferFull()
+                self._cond.wait(remaining)
+            # Reserve the room before writing, so concurrent appends cannot overshoot max_pending
+            self._pending += len(events)
+
+        try:
+            with self._write_lock:
+                if self._current is None:
+                    self._current = self._open_segment()
+                segment = self._current
+                segment.file.write(lines)
+                segment.file.flush()
+                self._written += 1
+                ticket = self._written
+                self._dirty.add(segment)
+                with self._cond:
+                    segment.size += len(events)
+                    if segment.size >= self.flush_size:
+                        self._cond.notify_all()
+        except Exception:
+            with self._cond:
+                self._pending -= len(events)
+                self._cond.notify_all()
+            raise
+
+        if self.fsync:
+            self._sync(ticket)
+
+    def _sync(self, ticket):
+        """
+        Wait until the append numbered `ticket` is on disk, fsync()ing on behalf of every append written so far
+        """
+        with self._sync_cond:
+            while self._syncing and self._synced < ticket:
+                self._sync_cond.wait()
+            if self._synced >= ticket:
+                return
+            self._syncing = True
+
+        with self._write_lock:
+            target = self._written
+            dirty, self._dirty = self._dirty, set()
+        try:
+            with self._sync_lock:
+                for segment in dirty:
+                    # Closed once applied and deleted, nothing left to sync
+                    if not segment.file.closed:
+                        os.fsync(segment.file.fileno())
+        except Exception:
+            with self._write_lock:
+                self._dirty |= dirty
+            raise
+        else:
+            with self._sync_cond:
+                self._synced = max(self._synced, target)
+        finally:
+            with self._sync_cond:
+                self._syncing = False
+                self._sync_cond.notify_all()
+
+    def metrics(self):
+        with self._cond:
+            return dict(queue_depth=self._pending,
+                        segments=len(self._sealed) + (self._current is not None),
+                        flushes=self.flushes,
+                        flushed_events=self.flushed_events,
+                        flush_errors=self.flush_errors,
+                        rejected=self.rejected,
+                        quarantined=self.quarantined,
+                        last_flush_seconds=self.last_flush_seconds,
+                        max_flush_seconds=self.max_flush_seconds,
+                        total_flush_seconds=self.total_flush_seconds)
+
+    def _open_segment(self):
+        name = '{}-{}-{}'.format(int(time() * 1000), os.getpid(), next(self._sequence))
+        temporary_path = os.path.join(self.directory, name + '.tmp')
+        path = os.path.join(self.directory, name + SEGMENT_SUFFIX)
+
+        file = open(temporary_path, 'x+')
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        # Only publish the segment under its final name once it is locked
+        os.rename(temporary_path, path)
+        return Segment(path, file)
+
+    def _recover(self):
+        """
+        Pick up segments that no live process holds a lock on
+        """
+        self._last_recovery = default_timer()
+        with self._cond:
+            known = {segment.path for segment in self._sealed}
+            if self._current is not None:
+                known.add(self._current.path)
+
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(SEGMENT_SUFFIX) or path in known:
+                continue
+            try:
+                file = open(path, 'r+')
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                file.close()
+                continue
+            if not os.path.exists(path):
+                # Applied and deleted by its owner in the meantime
+                file.close()
+                continue
+
+            size = sum(1 for line in file if line.strip())
+            logger.info('Replaying write-behind segment %s (%d events)', path, size)
+            with self._cond:
+                self._sealed.append(Segment(path, file, size))
+                self._pending += size
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            with self._cond:
+                if self._current is None or self._current.size < self.flush_size:
+                    self._cond.wait(self.flush_interval)
+            with self._write_lock, self._cond:
+                if self._current is not None and self._current.size > 0:
+                    self._sealed.append(self._current)
+                    self._current = None
+                sealed = list(self._sealed)
+
+            for segment in sealed:
+                if not self._flush(segment):
+                    break
+
+            if default_timer() - self._last_recovery > RECOVERY_INTERVAL:
+                try:
+                    self._recover()
+                except OSError:
+                    logger.exception('Write-behind recovery failed')
+
+    def _flush(self, segment):
+        """
+        :return: Whether the segments after this one are worth trying, i.e. the database is reachable
+        """
+        started = default_timer()
+        try:
+            segment.file.seek(0)
+            by_week = defaultdict(list)
+            for line in segment.file:
+                if not line.strip():
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # Torn write at the tail of a segment from a crashed process
+                    logger.warning('Skipping unreadable event in %s', segment.path)
+                    continue
+                by_week[event.pop('week')].append(event)
+
+            with self.app.app_context():
+                try:
+                    # One transaction for the whole segment: the upserts add to counters,
+                    # so a segment applied in part would be counted twice on replay
+                    for week, events in by_week.items():
+                        upsert_term_stats(events, week, commit=False)
+                    db.session.commit()
+                finally:
+                    db.session.remove()
+        except Exception:
+            logger.exception('Flushing write-behind segment %s failed', segment.path)
+            reachable = self._database_reachable()
+            with self._cond:
+                self.flush_errors += 1
+                if not reachable:
+                    # Back off instead of hammering an unavailable database
+                    self._cond.wait(self.flush_interval)
+                    return False
+                segment.failures += 1
+            if segment.failures >= self.max_attempts:
+                self._quarantine(segment)
+            return True
+
+        os.unlink(segment.path)
+        with self._sync_lock:
+            segment.close()
+        elapsed = default_timer() - started
+        with self._cond:
+            self._sealed.remove(segment)
+            self._pending -= segment.size
+            self.flushes += 1
+            self.flushed_events += segment.size
+            self.last_flush_seconds = elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+            self.total_flush_seconds += elapsed
+            self._cond.notify_all()
+        return True
+
+    def _database_reachable(self):
+        try:
+            with self.app.app_context():
+                try:
+                    db.session.execute(text('SELECT 1'))
+                finally:
+                    db.session.remove()
+        except Exception:
+            return False
+        return True
+
+    def _quarantine(self, segment):
+        path = segment.path[:-len(SEGMENT_SUFFIX)] + QUARANTINE_SUFFIX
+        os.rename(segment.path, path)
+        with self._sync_lock:
+            segment.close()
+        logger.error('Set aside write-behind segment %s (%d events) after %d failed flushes',
+                     path, segment.size, segment.failures)
+        with self._cond:
+            self._sealed.remove(segment)
+            self._pending -= segment.size
+            self.quarantined += 1
+            self._cond.notify_all()
+
+
+def _read_metric(key):
+    def read():
+        if buffer is None:
+            return dict()
+        return {(): buffer.metrics()[key]}
+    return read
+
+
+metrics.Gauge('write_behind_queue_depth', 'Answer events accepted but not applied yet',
+              callback=_read_metric('queue_depth'))
+metrics.Gauge('write_behind_segments', 'Open and sealed segments', callback=_read_metric('segments'))
+metrics.CounterCallback('write_behind_flushes_total', 'Segments applied', callback=_read_metric('flushes'))
+metrics.CounterCallback('write_behind_flushed_events_total', 'Answer events applied',
+                        callback=_read_metric('flushed_events'))
+metrics.CounterCallback('write_behind_flush_errors_total', 'Failed segment flushes',
+                        callback=_read_metric('flush_errors'))
+metrics.CounterCallback('write_behind_rejected_total', 'Appends rejected because the buffer was full',
+                        callback=_read_metric('rejected'))
+metrics.CounterCallback('write_behind_quarantined_total', 'Segments set aside after repeated failed flushes',
+                        callback=_read_metric('quarantined'))
+metrics.CounterCallback('write_behind_flush_seconds_total', 'Time spent applying segments',
+                        callback=_read_metric('total_flush_seconds'))
+
+
+def init_app(app):
+    global buffer
+    if WRITE_BEHIND_DIR is None:
+        return
+
+    buffer = WriteBehindBuffer(app, WRITE_BEHIND_DIR)
+    app.before_first_request(buffer.start)
@@ -1,8 +1,51 @@
+"""
+Production server
+
+WSGI_WORKERS=1 (the default) runs one CherryPy process. With more workers the
+master process loads the app and the read-only dictionary caches, binds the
+listening socket and forks the workers, so they share the caches copy-on-write
+and the socket's accept queue. Each worker runs a cheroot server with
+WSGI_THREADS threads and its own database connection pool.
+
+Signals to the master: SIGHUP forks fresh workers and gracefully stops the
+old ones, SIGTERM and SIGINT stop all workers gracefully. A worker that has
+served WSGI_MAX_REQUESTS requests (plus up to WSGI_MAX_REQUESTS_JITTER)
+finishes its in-flight requests and is replaced.
+"""
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import logging
+from itertools import count
+from random import randint
+from threading import Event, Thread
+
 import cherrypy
+from cheroot import wsgi
+
 from main import app
+from wordgameapi.models import db
+from wordgameapi import search, snapshot, term_store
 
-if __name__ == '__main__':
+WSGI_HOST = os.getenv('WSGI_HOST', '0.0.0.0')
+WSGI_PORT = int(os.getenv('WSGI_PORT', 8080))
+WSGI_THREADS = int(os.getenv('WSGI_THREADS', 30))
+# Worker processes, 0 for one per CPU
+WSGI_WORKERS = int(os.getenv('WSGI_WORKERS', 1)) or os.cpu_count()
+# Requests after which a worker is replaced, 0 to never recycle workers
+WSGI_MAX_REQUESTS = int(os.getenv('WSGI_MAX_REQUESTS', 0))
+WSGI_MAX_REQUESTS_JITTER = int(os.getenv('WSGI_MAX_REQUESTS_JITTER', 0))
+# Seconds a stopping worker gets to finish in-flight requests before it is killed
+WSGI_GRACEFUL_TIMEOUT = float(os.getenv('WSGI_GRACEFUL_TIMEOUT', 30))
+WSGI_BACKLOG = int(os.getenv('WSGI_BACKLOG', 1024))
 
+logger = logging.getLogger('wsgi')
+
+
+def serve_single():
     # Mount the application
     cherrypy.tree.graft(app, "/")
     cherrypy.config.update({
@@ -18,24 +61,176 @@ if __name__ == '__main__':
     server = cherrypy._cpserver.Server()
 
     # Configure the server object
-    server.socket_host = "0.0.0.0"
-    server.socket_port = 8080
-    server.thread_pool = 30
+    server.socket_host = WSGI_HOST
+    server.socket_port = WSGI_PORT
+    server.thread_pool = WSGI_THREADS
 
     # Subscribe this server
     server.subscribe()
 
-    # Example for a 2nd server (same steps as above):
-    # Remember to use a different port
+    cherrypy.engine.start()
+    cherrypy.engine.block()
 
-    # server2             = cherrypy._cpserver.Server()
 
-    # server2.socket_host = "0.0.0.0"
-    # server2.socket_port = 8081
-    # server2.thread_pool = 30
-    # server2.subscribe()
+class InheritedSocketServer(wsgi.Server):
+    """
+    cheroot server accepting on a socket bound by the master process
+    """
+    def __init__(self, listener, *args, **kwargs):
+        self.listener = listener
+        super().__init__(listener.getsockname()[:2], *args, **kwargs)
 
-    # Start the server engine (Option 1 *and* 2)
+    def bind(self, family, type, proto=0):
+        self.socket = self.listener
+        return self.socket
 
-    cherrypy.engine.start()
-    cherrypy.engine.block()
\ No newline at end of file
+
+def preload():
+    """
+    Load the read-only caches in the master, so forked workers share them
+    """
+    with app.app_context():
+        try:
+            snapshot.current()
+            term_store.store()
+            search.preload()
+        except Exception:
+            # Workers load whatever is missing on first use
+            logger.exception('Preloading the dictionary caches failed')
+        finally:
+            db.session.remove()
+            # Connections must not be shared with the workers
+            db.engine.dispose()
+
+
+def run_worker(listener):
+    stopping = Event()
+    served = count(1)
+    max_requests = WSGI_MAX_REQUESTS + randint(0, WSGI_MAX_REQUESTS_JITTER) if WSGI_MAX_REQUESTS > 0 else 0
+
+    def counted_app(environ, start_response):
+        if max_requests > 0 and next(served) >= max_requests:
+            stopping.set()
+        return app(environ, start_response)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    with app.app_context():
+        db.engine.dispose()
+
+    server = InheritedSocketServer(listener, counted_app,
+                                   numthreads=WSGI_THREADS,
+                                   request_queue_size=WSGI_BACKLOG,
+                                   shutdown_timeout=WSGI_GRACEFUL_TIMEOUT)
+    thread = Thread(target=server.safe_start, name='cheroot', daemon=True)
+    thread.start()
+    while not stopping.wait(1):
+        if not thread.is_alive():
+            os._exit(1)
+
+    server.stop()
+    os._exit(0)
+
+
+class Master:
+    def __init__(self, listener, workers):
+        self.listener = listener
+        self.workers = workers
+        # pid -> time the worker was asked to stop, None while serving
+        self.children = dict()
+        self.stopping = False
+        self.reload = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(self.listener)
+            finally:
+                os._exit(1)
+        self.children[pid] = None
+        logger.info('Worker %s started', pid)
+
+    def stop(self, pid):
+        if self.children.get(pid, 0) is None:
+            self.children[pid] = time.monotonic()
+            os.kill(pid, signal.SIGTERM)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.children.pop(pid, None)
+            logger.info('Worker %s exited with status %s', pid, status)
+
+    def kill_stragglers(self):
+        now = time.monotonic()
+        for pid, stopped_at in list(self.children.items()):
+            if stopped_at is not None and now - stopped_at > WSGI_GRACEFUL_TIMEOUT:
+                logger.warning('Worker %s did not stop in time, killing it', pid)
+                os.kill(pid, signal.SIGKILL)
+
+    def rolling_restart(self):
+        for pid in [pid for pid, stopped_at in self.children.items() if stopped_at is None]:
+            self.spawn()
+            self.stop(pid)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.on_stop)
+        signal.signal(signal.SIGINT, self.on_stop)
+        signal.signal(signal.SIGHUP, self.on_reload)
+
+        while not self.stopping or len(self.children) > 0:
+            self.reap()
+            self.kill_stragglers()
+            if self.stopping:
+                for pid in list(self.children):
+                    self.stop(pid)
+            else:
+                if self.reload:
+                    self.reload = False
+                    self.rolling_restart()
+                serving = sum(1 for stopped_at in self.children.values() if stopped_at is None)
+                for _ in range(self.workers - serving):
+                    self.spawn()
+                    # A worker crashing on start must not turn into a fork loop
+                    time.sleep(0.1)
+            time.sleep(0.5)
+
+    def on_stop(self, signum, frame):
+        self.stopping = True
+
+    def on_reload(self, signum, frame):
+        self.reload = True
+
+
+def serve_prefork(workers):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(process)d %(levelname)s %(message)s')
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((WSGI_HOST, WSGI_PORT))
+    listener.listen(WSGI_BACKLOG)
+
+    preload()
+    if hasattr(gc, 'freeze'):
+        # Keep the collector from touching, and so copying, the preloaded objects
+        gc.collect()
+        gc.freeze()
+
+    logger.info('Listening on %s:%s with %s workers', WSGI_HOST, WSGI_PORT, workers)
+    Master(listener, workers).run()
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    if WSGI_WORKERS > 1:
+        serve_prefork(WSGI_WORKERS)
+    else:
+        serve_single()